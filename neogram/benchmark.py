@@ -0,0 +1,503 @@
+"Benchmarks for performance-critical operations."
+
+import cProfile
+import glob
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import yaml
+
+from lib import *
+from minixml import Element
+from utils import N
+import schema
+
+
+def get_timelines(number, timelines=10, seed=0):
+    "Return a Timelines diagram with the given number of events and periods."
+    rnd = random.Random(seed)
+    result = Timelines("Benchmark")
+    for i in range(number):
+        timeline = f"Timeline {i % timelines}"
+        begin = rnd.uniform(0, 1_000_000)
+        if i % 4:
+            result += Event(f"Event {i}", begin, timeline=timeline, color="red")
+        else:
+            end = begin + rnd.uniform(0, 10_000)
+            result += Period(f"Period {i}", begin, end, timeline=timeline)
+    return result
+
+
+def bench_validation(number=20):
+    "Per-file schema validation cost for the docs examples; uncached and cached."
+    data = []
+    for filepath in sorted(glob.glob("*.yaml")):
+        with open(filepath) as infile:
+            data.append(yaml.safe_load(infile))
+
+    def uncached():
+        for instance in data:
+            schema.clear_validators()
+            schema.validate(instance)
+
+    def cached():
+        for instance in data:
+            schema.validate(instance)
+
+    print(f"validation, {len(data)} files:")
+    for name, func in [("uncached", uncached), ("cached", cached)]:
+        seconds = timeit.timeit(func, number=number) / (number * len(data))
+        print(f"  {name}: {1000 * seconds:.3f} ms per file")
+
+
+def bench_render_memory(number=10_000):
+    "Peak memory when writing SVG to file; via the full string and streamed."
+    diagram = get_timelines(number)
+    diagram.build()
+    print(f"render to file, {number} entries:")
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = os.path.join(dirpath, "benchmark.svg")
+
+        def full_string():
+            with open(filepath, "w") as outfile:
+                outfile.write(diagram.render())
+
+        def streamed():
+            diagram.render(filepath)
+
+        for name, func in [("full string", full_string), ("streamed", streamed)]:
+            tracemalloc.start()
+            func()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            size = os.path.getsize(filepath)
+            print(f"  {name}: peak {peak / 2**20:.1f} MiB, file {size / 2**20:.1f} MiB")
+
+
+def get_tree(number, depth):
+    "Return an element tree with the given number of elements in chains of depth."
+    root = Element("svg")
+    elem = root
+    for i in range(1, number):
+        if i % depth == 0:
+            elem = root
+        elem = elem.create("g", x=str(i), fill="none")
+    return root
+
+
+def bench_write(number=100_000, repeat=5):
+    "Time to serialize element trees of different depth."
+    print(f"write, {number} elements:")
+    for depth in [1, 10, 100, 1000, 10_000]:
+        root = get_tree(number, depth)
+        try:
+            seconds = timeit.timeit(
+                lambda: root.write(io.StringIO(), indent=2), number=repeat
+            )
+            print(f"  depth {depth}: {1000 * seconds / repeat:.0f} ms")
+        except RecursionError:
+            print(f"  depth {depth}: recursion error")
+
+
+def bench_element_memory(number=100_000):
+    "Memory per element, for elements as created when building a timelines."
+    tracemalloc.start()
+    root = Element("g")
+    for i in range(number):
+        root += Element("rect", x=N(i), y=N(2 * i), width=N(10), height=N(18))
+        root += Element("text", f"Label {i}", x=N(i), y=N(2 * i))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"element memory, {2 * number} elements:")
+    print(f"  {current / (2 * number):.0f} bytes per element")
+
+
+def get_scaled(number=10_000):
+    "Return the universe and earth test diagrams scaled up to number of entries."
+    import test
+
+    result = Timelines("Universe and Earth, scaled")
+    for i in itertools.count():
+        for entry in test.get_universe().entries + test.get_earth().entries:
+            if len(result.entries) >= number:
+                return result
+            entry.timeline = f"{entry.timeline} {i % 100}"
+            result += entry
+
+
+def bench_render_profile(number=10_000):
+    "Profile the rendering of the scaled universe and earth test diagrams."
+    diagram = get_scaled(number)
+    print(f"render profile, {number} entries:")
+    seconds = timeit.timeit(lambda: diagram.render(io.StringIO()), number=1)
+    print(f"  total: {1000 * seconds:.0f} ms")
+    profile = cProfile.Profile()
+    profile.runcall(diagram.render, io.StringIO())
+    stats = pstats.Stats(profile, stream=sys.stdout)
+    stats.sort_stats("tottime").print_stats(8)
+
+
+def bench_text_length(number=100_000):
+    "Time to measure labels; unique and repeated."
+    import utils
+
+    unique = [f"Label number {i}" for i in range(number)]
+    repeated = [f"Timeline {i % 100}" for i in range(number)]
+    print(f"text length, {number} labels:")
+    for name, labels in [("unique", unique), ("repeated", repeated)]:
+        seconds = timeit.timeit(
+            lambda: [utils.get_text_length(l, "sans-serif", 14) for l in labels],
+            number=1,
+        )
+        print(f"  {name}: {1000 * seconds:.0f} ms")
+
+
+def bench_server(number=200, clients=4):
+    "Throughput of the render server for a loopback client."
+    import concurrent.futures
+    import threading
+    import urllib.request
+
+    import constants
+    import neogram_serve
+
+    with open("pyramid.yaml") as infile:
+        data = infile.read().encode("utf-8")
+    server = neogram_serve.Server(port=0, workers=clients)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/svg"
+
+    def request(i):
+        request = urllib.request.Request(
+            url, data=data, headers={"Content-Type": constants.YAML_CONTENT_TYPE}
+        )
+        with urllib.request.urlopen(request) as response:
+            return len(response.read())
+
+    try:
+        request(0)  # Start up the worker processes.
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(request, range(number)))
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"render server, {number} requests, {clients} clients:")
+    print(f"  {number / seconds:.0f} requests per second")
+
+
+def bench_cache(number=2000, entries=5):
+    "Time to render a column of timelines, without and with the build cache."
+    import cache
+
+    column = Column("Benchmark")
+    for i in range(entries):
+        column += get_timelines(number, seed=i)
+    print(f"build cache, column of {entries} timelines of {number} entries:")
+    with tempfile.TemporaryDirectory() as dirpath:
+        for name in ["no cache", "cold cache", "warm cache"]:
+            if name == "cold cache":
+                buildcache = cache.enable(dirpath)
+            seconds = timeit.timeit(lambda: column.render(io.StringIO()), number=1)
+            print(f"  {name}: {1000 * seconds:.0f} ms")
+        print(f"  {buildcache.stats}")
+        cache.disable()
+
+
+def bench_includes(number=8):
+    "Time to read a column including remote notes, each with one second latency."
+    import http.server
+    import threading
+
+    import diagram
+    import test
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), test.StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/slow/declaration.yaml"
+    entries = [dict(note=url)] * number
+    print(f"includes, column of {number} remote notes:")
+    max_fetch_workers = diagram.MAX_FETCH_WORKERS
+    try:
+        for workers in [1, max_fetch_workers]:
+            diagram.MAX_FETCH_WORKERS = workers
+            seconds = timeit.timeit(lambda: Column(entries=entries), number=1)
+            print(f"  {workers} fetch workers: {seconds:.1f} s")
+    finally:
+        diagram.MAX_FETCH_WORKERS = max_fetch_workers
+        server.shutdown()
+        server.server_close()
+
+
+def bench_modified(number=10_000):
+    "Time to render a diagram again, unmodified and after a small modification."
+    timelines = get_timelines(number)
+    note = Note(body="Note")
+    column = Column(entries=[timelines, note])
+    print(f"rebuild, column of timelines of {number} entries and a note:")
+    seconds = timeit.timeit(lambda: column.render(io.StringIO()), number=1)
+    print(f"  first render: {1000 * seconds:.0f} ms")
+    seconds = timeit.timeit(lambda: column.render(io.StringIO()), number=1)
+    print(f"  unmodified: {1000 * seconds:.0f} ms")
+    note.body = "Modified note"
+    seconds = timeit.timeit(lambda: column.render(io.StringIO()), number=1)
+    print(f"  modified note: {1000 * seconds:.0f} ms")
+
+
+def bench_timelines(numbers=(1_000, 10_000, 100_000)):
+    "Time to build timelines; pure Python and, if available, using NumPy."
+    import timelines
+
+    minimum = Timelines.NUMPY_MIN_ENTRIES
+    try:
+        for number in numbers:
+            diagram = get_timelines(number)
+            print(f"timelines build, {number} entries:")
+            Timelines.NUMPY_MIN_ENTRIES = number + 1
+            seconds = timeit.timeit(diagram.build, number=1)
+            print(f"  pure Python: {1000 * seconds:.0f} ms")
+            if timelines.numpy is None:
+                print("  NumPy: not available")
+                continue
+            Timelines.NUMPY_MIN_ENTRIES = 0
+            seconds = timeit.timeit(diagram.build, number=1)
+            print(f"  NumPy: {1000 * seconds:.0f} ms")
+    finally:
+        Timelines.NUMPY_MIN_ENTRIES = minimum
+
+
+def bench_aggregate(number=100_000, aggregate=3):
+    "Size and time to render timelines; all events, and dense ones aggregated."
+    diagram = get_timelines(number)
+    print(f"aggregate, timelines of {number} entries:")
+    for value in [None, aggregate]:
+        diagram.aggregate = value
+        outfile = io.StringIO()
+        seconds = timeit.timeit(lambda: diagram.render(outfile), number=1)
+        size = len(outfile.getvalue().encode("utf-8")) / 2**20
+        print(f"  aggregate {value}: {1000 * seconds:.0f} ms, {size:.1f} MB")
+
+
+def bench_labels(numbers=(10_000, 50_000)):
+    "Time to render timelines with labels overlapping, hidden or stacked."
+    for number in numbers:
+        diagram = get_timelines(number)
+        print(f"labels, timelines of {number} entries:")
+        for value in ["overlap", "hide", "stack"]:
+            diagram.labels = value
+            seconds = timeit.timeit(diagram.render, number=1)
+            print(f"  labels {value}: {1000 * seconds:.0f} ms")
+
+
+def bench_lanes(numbers=(10_000, 100_000)):
+    "Time to render timelines with overlapping periods, with and without lanes."
+    for number in numbers:
+        diagram = get_timelines(number)
+        print(f"lanes, timelines of {number} entries:")
+        for value in [False, True]:
+            diagram.lanes = value
+            seconds = timeit.timeit(diagram.render, number=1)
+            print(
+                f"  lanes {value}: {1000 * seconds:.0f} ms, height {diagram.height:.0f}"
+            )
+
+
+def bench_markers(number=100_000):
+    "Size and time to render path markers; each in full, or defined once."
+    rnd = random.Random(0)
+    diagram = Timelines("Markers")
+    markers = ["pyramid", "triangle", "star"]
+    for i in range(number):
+        diagram += Event(
+            f"Event {i}",
+            rnd.uniform(0, 1_000_000),
+            timeline=f"Timeline {i % 10}",
+            marker=markers[i % len(markers)],
+        )
+    print(f"markers, timelines of {number} events:")
+    original = Timelines.SHARED_DEFS
+    try:
+        for value in [False, True]:
+            Timelines.SHARED_DEFS = value
+            diagram.invalidate()
+            outfile = io.StringIO()
+            seconds = timeit.timeit(lambda: diagram.render(outfile), number=1)
+            size = len(outfile.getvalue().encode("utf-8")) / 2**20
+            print(f"  shared {value}: {1000 * seconds:.0f} ms, {size:.1f} MB")
+    finally:
+        Timelines.SHARED_DEFS = original
+
+
+def bench_gradients(number=20_000):
+    "Size and time to render gradient periods; defined for each, or shared."
+    rnd = random.Random(0)
+    diagram = Timelines("Gradients")
+    colors = ["orange", "navy", "wheat"]
+    for i in range(number):
+        begin = rnd.uniform(0, 1_000_000)
+        diagram += Period(
+            f"Period {i}",
+            {"value": begin, "error": 1_000},
+            {"value": begin + rnd.uniform(0, 10_000), "error": 1_000},
+            timeline=f"Timeline {i % 10}",
+            color=colors[i % len(colors)],
+            fuzzy="gradient",
+        )
+    print(f"gradients, timelines of {number} periods:")
+    original = Timelines.SHARED_DEFS
+    try:
+        for value in [False, True]:
+            Timelines.SHARED_DEFS = value
+            diagram.invalidate()
+            outfile = io.StringIO()
+            seconds = timeit.timeit(lambda: diagram.render(outfile), number=1)
+            size = len(outfile.getvalue().encode("utf-8")) / 2**20
+            print(f"  shared {value}: {1000 * seconds:.0f} ms, {size:.1f} MB")
+    finally:
+        Timelines.SHARED_DEFS = original
+
+
+def bench_cairo(number=10_000):
+    "Time to render PNG of the scaled test diagrams; via SVG, and directly."
+    import neogram2png
+
+    diagram = get_scaled(number)
+    print(f"cairo, {number} entries:")
+    for direct in [False, True]:
+        seconds = timeit.timeit(
+            lambda: neogram2png.get_png(diagram, direct=direct), number=1
+        )
+        print(f"  direct {direct}: {1000 * seconds:.0f} ms")
+
+
+def bench_pdf(numbers=(100, 500, 1000)):
+    """Pages per second and peak memory when writing test diagrams as PDF pages.
+    The peak memory should not grow with the number of pages.
+    """
+    import cairorender
+    import neogram2pdf
+
+    infilepaths = sorted(glob.glob("*.yaml"))
+    print("pdf:")
+    for number in numbers:
+        # The file list is repeated, not the diagrams; cycling the diagrams
+        # would keep every one of them in memory.
+        pages = neogram2pdf.get_pages(
+            itertools.islice(itertools.cycle(infilepaths), number)
+        )
+        with tempfile.TemporaryDirectory() as dirpath:
+            tracemalloc.start()
+            start = time.perf_counter()
+            cairorender.write_pdf(pages, os.path.join(dirpath, "pages.pdf"))
+            seconds = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print(
+            f"  {number} pages: {number / seconds:.1f} pages/s,"
+            f" peak {peak / 2**20:.1f} MB"
+        )
+
+
+def bench_tiles(scale=8):
+    "Tiles per second when rendering the poster as tiles, by number of workers."
+    import tiles
+
+    diagram = retrieve("poster.yaml")
+    print(f"tiles, poster at scale {scale}:")
+    for workers in sorted(set([1, os.cpu_count()])):
+        with tempfile.TemporaryDirectory() as dirpath:
+            start = time.perf_counter()
+            count = tiles.write_tiles(diagram, dirpath, scale=scale, workers=workers)
+            seconds = time.perf_counter() - start
+        print(f"  {workers} workers: {count} tiles, {count / seconds:.1f} tiles/s")
+
+
+def bench_scales(number=10_000, scales=(1, 2, 3)):
+    "Time to render PNGs at several scales; one at a time, and in one pass."
+    import neogram2png
+
+    print(f"scales {scales}, {number} entries:")
+    with tempfile.TemporaryDirectory() as dirpath:
+        outfilepaths = dict(
+            [(s, os.path.join(dirpath, f"scaled@{s}x.png")) for s in scales]
+        )
+        start = time.perf_counter()
+        for scale, outfilepath in outfilepaths.items():
+            neogram2png.write_png(get_scaled(number), outfilepath, scale=scale)
+        print(f"  one at a time: {1000 * (time.perf_counter() - start):.0f} ms")
+        for workers in [1, len(scales)]:
+            start = time.perf_counter()
+            neogram2png.write_pngs(get_scaled(number), outfilepaths, workers=workers)
+            seconds = time.perf_counter() - start
+            print(f"  one pass, {workers} workers: {1000 * seconds:.0f} ms")
+
+
+def bench_encoding():
+    "Total byte size and encode time of the test diagrams for output options."
+    import neogram2png
+
+    encodings = [
+        ("default", None),
+        ("compression 9", dict(compression=9)),
+        ("strip", dict(strip=True)),
+        ("colors 256", dict(colors=256)),
+        ("colors 64", dict(colors=64, compression=9, strip=True)),
+        ("colors 16", dict(colors=16, compression=9, strip=True)),
+        ("webp", dict(format="webp")),
+        ("webp colors 64", dict(format="webp", colors=64, compression=9)),
+    ]
+    pngs = [neogram2png.get_png(retrieve(f)) for f in sorted(glob.glob("*.yaml"))]
+    print(f"encoding, {len(pngs)} test diagrams:")
+    print(f"  {'options':<16}{'bytes':>10}{'ratio':>8}{'ms':>8}")
+    total = sum([len(data) for data in pngs])
+    for name, encoding in encodings:
+        start = time.perf_counter()
+        if encoding:
+            size = sum([len(neogram2png.encode(data, **encoding)) for data in pngs])
+        else:
+            size = total
+        seconds = time.perf_counter() - start
+        print(f"  {name:<16}{size:>10}{size / total:>8.2f}{1000 * seconds:>8.0f}")
+
+
+def run_benchmarks():
+    origdir = os.getcwd()
+    try:
+        os.chdir("../docs")
+        bench_validation()
+        bench_render_memory()
+        bench_write()
+        bench_element_memory()
+        bench_render_profile()
+        bench_text_length()
+        bench_server()
+        bench_cache()
+        bench_includes()
+        bench_modified()
+        bench_timelines()
+        bench_aggregate()
+        bench_labels()
+        bench_lanes()
+        bench_markers()
+        bench_gradients()
+        bench_cairo()
+        bench_pdf()
+        bench_tiles()
+        bench_scales()
+        bench_encoding()
+    finally:
+        os.chdir(origdir)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
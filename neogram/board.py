@@ -71,6 +71,8 @@ class Board(Diagram):
             entry = fields
         self.check_entry(entry)
         self.entries.append(entry)
+        entry["diagram"].add_container(self)
+        self.invalidate()
 
     def check_entry(self, entry):
         if not isinstance(entry, dict):
@@ -78,21 +80,48 @@ class Board(Diagram):
         for key in constants.COMPOSABLE_DIAGRAMS:
             data = entry.get(key)
             if data:
-                # No need to use 'memo' here; board cannot refer to another board.
-                if isinstance(data, dict):
-                    data = parse(key, entry[key])
+                if isinstance(data, (dict, str)):
+                    data = parse(key, data)
                 entry["diagram"] = data
                 break
         else:
             raise ValueError(f"invalid entry for board: {entry}")
 
+    def resolve_includes(self, entries):
+        """Return the entries with included locations replaced by diagrams.
+        The locations are fetched concurrently.
+        """
+        locations = {}  # Key: (index of entry, key); value: location.
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                continue
+            for key in constants.COMPOSABLE_DIAGRAMS:
+                if isinstance(value := entry.get(key), str):
+                    locations[(i, key)] = value
+        if not locations:
+            return entries
+        result = list(entries)
+        readers = fetch(list(locations.values()))
+        for ((i, key), location), reader in zip(locations.items(), readers):
+            result[i] = dict(result[i])
+            result[i][key] = include(location, reader=reader)
+        return result
+
+    def get_subdiagrams(self):
+        "Return the diagrams directly contained in this diagram."
+        return [entry["diagram"] for entry in self.entries]
+
     def data_as_dict_entries(self):
         result = []
         for entry in self.entries:
             entry2 = {"x": entry["x"], "y": entry["y"]}
             if scale := entry.get("scale"):
                 entry2["scale"] = scale
-            entry2.update(entry["diagram"].as_dict())
+            diagram = entry["diagram"]
+            try:  # If this diagram was included from another source.
+                entry2[diagram.__class__.__name__.casefold()] = diagram.location
+            except AttributeError:
+                entry2.update(diagram.as_dict())
             result.append(entry2)
         return {"entries": result}
 
@@ -102,7 +131,7 @@ class Board(Diagram):
         Sets the 'width' attribute.
         """
         for entry in self.entries:
-            entry["diagram"].build()
+            entry["diagram"].build_cached()
 
         self.width = 0
         for entry in self.entries:
@@ -123,7 +152,7 @@ class Board(Diagram):
                 pass
             transform.append(f"translate({entry['x']}, {entry['y'] + offset})")
             g = Element("g", transform=" ".join(transform))
-            g.append(diagram.svg)
+            g.append(diagram.get_svg(self))
             self.svg += g
             self.height = max(self.height, entry["y"] + offset + scale * diagram.height)
 
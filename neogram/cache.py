@@ -0,0 +1,211 @@
+"""On-disk content-addressed cache for built diagrams.
+The key is a hash of the normalized diagram data, including that of included
+diagrams, the class-level settings, and the software version.
+The cached value is the built SVG element tree, its definitions,
+the width and the height.
+The cache is bounded in size; the least recently used items are evicted.
+The items are stored using pickle, and loading one may run arbitrary code,
+so the cache directory must be trusted: not writable by anyone else.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import re
+
+import constants
+import utils
+
+DEFAULT_MAX_SIZE = 100 * 2**20  # Bytes.
+
+# The currently active cache, if any.
+_cache = None
+
+
+def enable(dirpath, max_size=DEFAULT_MAX_SIZE):
+    """Enable the cache in the given directory, which must be trusted.
+    Return the cache.
+    """
+    global _cache
+    _cache = Cache(dirpath, max_size=max_size)
+    return _cache
+
+
+def disable():
+    "Disable the cache. The cache directory is not removed."
+    global _cache
+    _cache = None
+
+
+def get():
+    "Return the currently active cache, or None."
+    return _cache
+
+
+class Cache:
+    "Size-bounded LRU cache of built diagrams stored as files in a directory."
+
+    SUFFIX = ".pickle"  # Built diagram.
+    VALID_SUFFIX = ".valid"  # Marker for validated YAML data.
+
+    def __init__(self, dirpath, max_size=DEFAULT_MAX_SIZE):
+        assert isinstance(max_size, int) and max_size > 0
+        self.dirpath = pathlib.Path(dirpath)
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.size = sum([p.stat().st_size for p in self.filepaths()])
+        self.reset_stats()
+
+    def __repr__(self):
+        return f"Cache('{self.dirpath}')"
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @property
+    def stats(self):
+        "Return the statistics of cache use as a dictionary."
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            writes=self.writes,
+            evictions=self.evictions,
+            size=self.size,
+        )
+
+    def filepaths(self):
+        "Return the paths of the files for all items in the cache."
+        return [
+            p
+            for p in self.dirpath.iterdir()
+            if p.suffix in (self.SUFFIX, self.VALID_SUFFIX)
+        ]
+
+    def get_filepath(self, key, suffix=None):
+        return self.dirpath.joinpath(key).with_suffix(suffix or self.SUFFIX)
+
+    def get_key(self, diagram):
+        """Return the key for the diagram; hash of its normalized data, including
+        the content of included diagrams, the settings, and the version.
+        """
+        data = json.dumps(
+            [constants.__version__, diagram.get_key_data()], sort_keys=True, default=str
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get_data_key(self, data):
+        "Return the key for YAML data; hash of the data and version."
+        data = f"{constants.__version__}\n{data}"
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def is_valid(self, data):
+        "Has the YAML data previously been checked against the schema?"
+        filepath = self.get_filepath(self.get_data_key(data), self.VALID_SUFFIX)
+        try:
+            os.utime(filepath)  # Mark as recently used.
+        except OSError:
+            return False
+        return True
+
+    def set_valid(self, data):
+        "Record that the YAML data has been checked against the schema."
+        self.get_filepath(self.get_data_key(data), self.VALID_SUFFIX).touch()
+
+    def load(self, diagram, key=None):
+        """Set the 'svg', 'defs', 'width' and 'height' attributes of the diagram
+        from the cache. Return True if found, else False.
+        """
+        filepath = self.get_filepath(key or self.get_key(diagram))
+        try:
+            with open(filepath, "rb") as infile:
+                svg, defs, width, height = pickle.load(infile)
+            os.utime(filepath)  # Mark as recently used.
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            self.misses += 1
+            return False
+        renew_ids(svg)
+        diagram.svg = svg
+        diagram.defs = defs
+        diagram.width = width
+        diagram.height = height
+        self.hits += 1
+        return True
+
+    def store(self, diagram, key=None):
+        "Store the built diagram in the cache. Evict items if too large."
+        filepath = self.get_filepath(key or self.get_key(diagram))
+        data = pickle.dumps((diagram.svg, diagram.defs, diagram.width, diagram.height))
+        try:  # An existing item is replaced; its size no longer counts.
+            replaced = filepath.stat().st_size
+        except OSError:
+            replaced = 0
+        # Write to a temporary file first, in case of concurrent use.
+        tmppath = filepath.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmppath, "wb") as outfile:
+                outfile.write(data)
+            os.replace(tmppath, filepath)
+        except OSError:
+            return
+        self.size += len(data) - replaced
+        self.writes += 1
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        "Remove the least recently used items until within the maximum size."
+        items = []
+        for filepath in self.filepaths():
+            try:
+                stat = filepath.stat()
+            except OSError:  # Removed by another process.
+                continue
+            items.append((stat.st_mtime, stat.st_size, filepath))
+        items.sort()
+        self.size = sum([size for mtime, size, filepath in items])
+        for mtime, size, filepath in items:
+            if self.size <= self.max_size:
+                break
+            try:
+                filepath.unlink()
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        "Remove all items from the cache."
+        for filepath in self.filepaths():
+            filepath.unlink(missing_ok=True)
+        self.size = 0
+
+
+# Reference to an id in an attribute value.
+URL_ID = re.compile(r"url\(#([^)]+)\)")
+
+
+def renew_ids(svg):
+    """Replace the ids in the element tree by new unique ones.
+    Required since the ids in a cached tree may clash with those created
+    when building other diagrams.
+    """
+    ids = {}  # Key: old id; value: new id.
+    for elem in svg.walk(lambda e: "id" in e):
+        new = next(utils.unique_id)
+        ids[elem["id"]] = new
+        elem["id"] = new
+    if not ids:
+        return
+    for elem in svg.walk():
+        for name, value in list(elem.items()):
+            if "url(#" in value:
+                elem[name] = URL_ID.sub(
+                    lambda m: f"url(#{ids.get(m.group(1), m.group(1))})", value
+                )
+            elif name == "href" and value.startswith("#"):
+                elem[name] = f"#{ids.get(value[1:], value[1:])}"
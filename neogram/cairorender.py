@@ -0,0 +1,484 @@
+"""Render a diagram directly onto a cairo surface, producing PNG or PDF.
+The built SVG element tree is walked and drawn using cairo calls, instead
+of writing it out as an SVG string and having cairosvg parse it again.
+Only the subset of SVG produced by Neogram is handled.
+"""
+
+import functools
+import io
+import math
+import os
+import pathlib
+import re
+
+import cairocffi
+
+from color import Color
+from minixml import Element
+
+# Device units (points) per user unit (pixel) in PDF; 72 / 96 dpi.
+PDF_UNITS = 0.75
+
+# Properties inherited from the parent element, and their initial values.
+INHERITED = {
+    "fill": "black",
+    "fill-opacity": "1",
+    "stroke": "none",
+    "stroke-opacity": "1",
+    "stroke-width": "1",
+    "font-family": "sans-serif",
+    "font-size": "12",
+    "font-style": "normal",
+    "font-weight": "normal",
+    "text-anchor": "start",
+}
+
+SLANTS = {
+    "italic": cairocffi.FONT_SLANT_ITALIC,
+    "oblique": cairocffi.FONT_SLANT_OBLIQUE,
+}
+WEIGHTS = {"bold": cairocffi.FONT_WEIGHT_BOLD}
+
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+PATH_TOKEN = re.compile(
+    r"[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+)
+TRANSFORM = re.compile(r"(\w+)\s*\(([^)]*)\)")
+URL = re.compile(r"url\(#([^)]+)\)")
+
+# Number of parameters for each path command.
+PATH_PARAMETERS = dict(M=2, L=2, H=1, V=1, C=6, S=4, Q=4, T=2, A=7, Z=0)
+
+
+def get_png(diagram, scale=1.0):
+    "Render the diagram and return the PNG data."
+    return get_document_png(diagram.get_document(), scale=scale)
+
+
+def get_document_png(document, scale=1.0):
+    "Render the SVG document element tree and return the PNG data."
+    width, height = get_size(document)
+    surface = cairocffi.ImageSurface(
+        cairocffi.FORMAT_ARGB32, int(width * scale), int(height * scale)
+    )
+    context = cairocffi.Context(surface)
+    context.scale(scale, scale)
+    Renderer(context, document).draw(document)
+    outfile = io.BytesIO()
+    surface.write_to_png(outfile)
+    return outfile.getvalue()
+
+
+def get_pdf(diagram, scale=1.0):
+    "Render the diagram and return the PDF data."
+    outfile = io.BytesIO()
+    write_pdf([diagram], outfile, scale=scale)
+    return outfile.getvalue()
+
+
+def write_pdf(diagrams, target, scale=1.0):
+    """Render the diagrams as the pages of one PDF, written to the file
+    given by path, or to the open file object. Each page has the size of
+    its diagram. The diagrams may be given by an iterator; each is rendered
+    in turn, and cairo writes out each page when done, so the memory used
+    does not grow with the number of pages. Return the number of pages.
+    If any error, then the surface is finished anyway, and a file given by
+    path is removed, so that no truncated PDF is left.
+    """
+    if isinstance(target, pathlib.Path):
+        target = str(target)
+    surface = None
+    pages = 0
+    try:
+        for diagram in diagrams:
+            document = diagram.get_document()
+            width, height = get_size(document)
+            width *= scale * PDF_UNITS
+            height *= scale * PDF_UNITS
+            if surface is None:
+                surface = cairocffi.PDFSurface(target, width, height)
+                context = cairocffi.Context(surface)
+            else:
+                surface.set_size(width, height)
+            context.save()
+            context.scale(scale * PDF_UNITS, scale * PDF_UNITS)
+            Renderer(context, document).draw(document)
+            context.restore()
+            context.show_page()
+            pages += 1
+    except Exception:
+        if surface is not None:
+            surface.finish()
+            if isinstance(target, str):
+                os.remove(target)
+        raise
+    if surface is not None:
+        surface.finish()
+    return pages
+
+
+def get_size(document):
+    "Return the width and height of the SVG document, in user units."
+    return float(document["width"]), float(document["height"])
+
+
+@functools.lru_cache(maxsize=256)
+def get_rgb(value):
+    "Return the red, green and blue components (0 to 1) of the color value."
+    return tuple([c / 255 for c in Color(value).rgb])
+
+
+class Renderer:
+    "Draw an SVG element tree onto a cairo context."
+
+    def __init__(self, context, document):
+        self.context = context
+        # Elements referred to by id; definitions of markers and gradients.
+        self.ids = dict([(e["id"], e) for e in document.walk(lambda e: "id" in e)])
+        self.font = None  # The font currently set in the context.
+
+    def draw(self, elem, style=INHERITED):
+        "Draw the element and its subelements, given the inherited style."
+        changed = [(n, v) for n, v in elem.items() if n in INHERITED]
+        if changed:
+            style = style.copy()
+            style.update(changed)
+        context = self.context
+        transform = elem.get("transform")
+        if transform:
+            context.save()
+            apply_transform(context, transform)
+
+        match elem.tag:
+
+            case "svg" | "g":
+                for subelement in elem:
+                    if isinstance(subelement, Element):
+                        self.draw(subelement, style)
+
+            case "rect":
+                x = get_number(elem, "x")
+                y = get_number(elem, "y")
+                width = get_number(elem, "width")
+                height = get_number(elem, "height")
+                rx = get_number(elem, "rx") or get_number(elem, "ry")
+                ry = get_number(elem, "ry") or rx
+                if rx and ry:
+                    rx = min(rx, width / 2)
+                    ry = min(ry, height / 2)
+                    context.new_sub_path()
+                    ellipse(context, x + width - rx, y + ry, rx, ry, -math.pi / 2, 0)
+                    ellipse(
+                        context, x + width - rx, y + height - ry, rx, ry, 0, math.pi / 2
+                    )
+                    ellipse(
+                        context, x + rx, y + height - ry, rx, ry, math.pi / 2, math.pi
+                    )
+                    ellipse(context, x + rx, y + ry, rx, ry, math.pi, 3 * math.pi / 2)
+                    context.close_path()
+                else:
+                    context.rectangle(x, y, width, height)
+                self.paint(style)
+
+            case "circle":
+                r = get_number(elem, "r")
+                context.new_sub_path()
+                context.arc(
+                    get_number(elem, "cx"), get_number(elem, "cy"), r, 0, 2 * math.pi
+                )
+                self.paint(style)
+
+            case "ellipse":
+                context.new_sub_path()
+                ellipse(
+                    context,
+                    get_number(elem, "cx"),
+                    get_number(elem, "cy"),
+                    get_number(elem, "rx"),
+                    get_number(elem, "ry"),
+                )
+                context.close_path()
+                self.paint(style)
+
+            case "line":
+                context.move_to(get_number(elem, "x1"), get_number(elem, "y1"))
+                context.line_to(get_number(elem, "x2"), get_number(elem, "y2"))
+                self.paint(style, fill=False)
+
+            case "path":
+                draw_path(context, elem.get("d", ""))
+                self.paint(style)
+
+            case "text":
+                self.draw_text(elem, style)
+
+            case "use":
+                href = elem.get("href") or elem.get("xlink:href") or ""
+                if (ref := self.ids.get(href.lstrip("#"))) is not None:
+                    context.save()
+                    context.translate(get_number(elem, "x"), get_number(elem, "y"))
+                    self.draw(ref, style)
+                    context.restore()
+                    self.font = None
+
+            # Not drawn: 'defs', 'linearGradient', 'stop', 'title'.
+
+        if transform:
+            context.restore()
+            self.font = None  # Restored with the rest of the graphics state.
+
+    def draw_text(self, elem, style):
+        "Draw the text content of the element, positioned by its anchor."
+        text = elem.text
+        if not text:
+            return
+        context = self.context
+        font = (
+            style["font-family"],
+            style["font-style"],
+            style["font-weight"],
+            style["font-size"],
+        )
+        if font != self.font:  # Set only when changed; mostly the same.
+            context.select_font_face(
+                style["font-family"].split(",")[0].strip("\"' "),
+                SLANTS.get(style["font-style"], cairocffi.FONT_SLANT_NORMAL),
+                WEIGHTS.get(style["font-weight"], cairocffi.FONT_WEIGHT_NORMAL),
+            )
+            context.set_font_size(float(NUMBER.match(style["font-size"]).group()))
+            self.font = font
+        x_bearing, y_bearing, width = context.text_extents(text)[:3]
+        x = get_number(elem, "x")
+        match style["text-anchor"]:
+            case "middle":
+                x -= width / 2 + x_bearing
+            case "end":
+                x -= width + x_bearing
+        context.move_to(x, get_number(elem, "y"))
+        # Glyphs shown as such, as by cairosvg, unless to be stroked.
+        if style["stroke"] == "none" and self.set_source(
+            style["fill"], style["fill-opacity"]
+        ):
+            context.show_text(text)
+            context.new_path()
+        else:
+            context.text_path(text)
+            self.paint(style)
+
+    def paint(self, style, fill=True):
+        "Fill and stroke the current path according to the style, then clear it."
+        context = self.context
+        if fill and self.set_source(style["fill"], style["fill-opacity"]):
+            context.fill_preserve()
+        if self.set_source(style["stroke"], style["stroke-opacity"]):
+            context.set_line_width(float(style["stroke-width"]))
+            context.stroke_preserve()
+        context.new_path()
+
+    def set_source(self, paint, opacity):
+        """Set the source for the paint; color or gradient.
+        Return False if nothing is to be painted.
+        """
+        if paint == "none":
+            return False
+        context = self.context
+        if match := URL.match(paint):
+            gradient = self.ids.get(match.group(1))
+            if gradient is None or gradient.tag != "linearGradient":
+                return False
+            # The gradient vector is relative to the bounding box.
+            x1, y1, x2, y2 = context.path_extents()
+            pattern = cairocffi.LinearGradient(
+                x1 + get_number(gradient, "x1") * (x2 - x1),
+                y1 + get_number(gradient, "y1") * (y2 - y1),
+                x1 + get_number(gradient, "x2", 1) * (x2 - x1),
+                y1 + get_number(gradient, "y2") * (y2 - y1),
+            )
+            for stop in gradient:
+                if isinstance(stop, Element) and stop.tag == "stop":
+                    pattern.add_color_stop_rgba(
+                        get_number(stop, "offset"),
+                        *get_rgb(stop.get("stop-color", "black")),
+                        get_number(stop, "stop-opacity", 1) * float(opacity),
+                    )
+            context.set_source(pattern)
+        else:
+            context.set_source_rgba(*get_rgb(paint), float(opacity))
+        return True
+
+
+def get_number(elem, name, default=0):
+    "Return the numerical value of the attribute, or the default."
+    try:
+        return float(elem[name])
+    except KeyError:
+        return default
+
+
+def apply_transform(context, transform):
+    "Apply the SVG transform specification to the context."
+    for name, args in TRANSFORM.findall(transform):
+        args = [float(a) for a in NUMBER.findall(args)]
+        match name:
+            case "translate":
+                context.translate(args[0], args[1] if len(args) > 1 else 0)
+            case "scale":
+                context.scale(args[0], args[1] if len(args) > 1 else args[0])
+            case "rotate":
+                if len(args) == 3:
+                    context.translate(args[1], args[2])
+                    context.rotate(math.radians(args[0]))
+                    context.translate(-args[1], -args[2])
+                else:
+                    context.rotate(math.radians(args[0]))
+            case "matrix":
+                context.transform(cairocffi.Matrix(*args))
+
+
+def ellipse(context, cx, cy, rx, ry, angle1=0, angle2=2 * math.pi):
+    "Add an elliptical arc to the current path."
+    if not rx or not ry:
+        return
+    context.save()
+    context.translate(cx, cy)
+    context.scale(rx, ry)
+    context.arc(0, 0, 1, angle1, angle2)
+    context.restore()
+
+
+def draw_path(context, d):
+    "Add the SVG path data to the current path of the context."
+    tokens = PATH_TOKEN.findall(d)
+    x = y = 0.0  # Current point.
+    start = (0.0, 0.0)  # Start of the current subpath.
+    control = None  # Kind and last control point of a curve, for smooth curves.
+    command = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                context.close_path()
+                x, y = start
+                control = None
+                continue
+        elif command is None:
+            raise ValueError(f"invalid path data: {d}")
+        upper = command.upper()
+        count = PATH_PARAMETERS[upper]
+        args = [float(t) for t in tokens[i : i + count]]
+        i += count
+        if command.islower():  # Relative; make the coordinates absolute.
+            match upper:
+                case "H":
+                    args[0] += x
+                case "V":
+                    args[0] += y
+                case "A":
+                    args[5] += x
+                    args[6] += y
+                case _:
+                    for j in range(0, count, 2):
+                        args[j] += x
+                        args[j + 1] += y
+        previous = control
+        control = None
+
+        match upper:
+            case "M":
+                x, y = args
+                context.move_to(x, y)
+                start = (x, y)
+                # Further coordinate pairs are implicit lineto's.
+                command = "l" if command == "m" else "L"
+            case "L":
+                x, y = args
+                context.line_to(x, y)
+            case "H":
+                x = args[0]
+                context.line_to(x, y)
+            case "V":
+                y = args[0]
+                context.line_to(x, y)
+            case "C":
+                context.curve_to(*args)
+                control = ("C", args[2], args[3])
+                x, y = args[4], args[5]
+            case "S":
+                x1, y1 = reflect(previous, "C", x, y)
+                context.curve_to(x1, y1, *args)
+                control = ("C", args[0], args[1])
+                x, y = args[2], args[3]
+            case "Q" | "T":
+                if upper == "Q":
+                    qx, qy = args[0], args[1]
+                    x2, y2 = args[2], args[3]
+                else:
+                    qx, qy = reflect(previous, "Q", x, y)
+                    x2, y2 = args[0], args[1]
+                # Quadratic Bezier as cubic.
+                context.curve_to(
+                    x + 2 / 3 * (qx - x),
+                    y + 2 / 3 * (qy - y),
+                    x2 + 2 / 3 * (qx - x2),
+                    y2 + 2 / 3 * (qy - y2),
+                    x2,
+                    y2,
+                )
+                control = ("Q", qx, qy)
+                x, y = x2, y2
+            case "A":
+                draw_arc(context, x, y, *args)
+                x, y = args[5], args[6]
+
+
+def reflect(control, kind, x, y):
+    """Return the reflection in the current point of the control point
+    of the previous curve, if of the same kind; else the current point.
+    """
+    if control is None or control[0] != kind:
+        return x, y
+    return 2 * x - control[1], 2 * y - control[2]
+
+
+def draw_arc(context, x1, y1, rx, ry, rotation, large, sweep, x2, y2):
+    """Add the SVG elliptical arc from the current point to the path.
+    Conversion from endpoint to center parameterization; SVG spec F.6.5.
+    """
+    if (x1, y1) == (x2, y2):
+        return
+    if not rx or not ry:
+        context.line_to(x2, y2)
+        return
+    rx, ry = abs(rx), abs(ry)
+    phi = math.radians(rotation)
+    cos, sin = math.cos(phi), math.sin(phi)
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p = cos * dx + sin * dy
+    y1p = -sin * dx + cos * dy
+    # Scale up the radii if too small to reach the end point.
+    scale = (x1p / rx) ** 2 + (y1p / ry) ** 2
+    if scale > 1:
+        rx *= math.sqrt(scale)
+        ry *= math.sqrt(scale)
+    numerator = (rx * ry) ** 2 - (rx * y1p) ** 2 - (ry * x1p) ** 2
+    denominator = (rx * y1p) ** 2 + (ry * x1p) ** 2
+    factor = math.sqrt(max(0, numerator / denominator))
+    if bool(large) == bool(sweep):
+        factor = -factor
+    cxp = factor * rx * y1p / ry
+    cyp = -factor * ry * x1p / rx
+    cx = cos * cxp - sin * cyp + (x1 + x2) / 2
+    cy = sin * cxp + cos * cyp + (y1 + y2) / 2
+    angle1 = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    angle2 = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx)
+    context.save()
+    context.translate(cx, cy)
+    context.rotate(phi)
+    context.scale(rx, ry)
+    if sweep:
+        context.arc(0, 0, 1, angle1, angle2)
+    else:
+        context.arc_negative(0, 0, 1, angle1, angle2)
+    context.restore()
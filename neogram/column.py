@@ -53,7 +53,7 @@ class Column(Container):
         Sets the 'width' attribute.
         """
         for entry in self.entries:
-            entry.build()
+            entry.build_cached()
 
         self.width = max([e.width for e in self.entries])
 
@@ -71,7 +71,9 @@ class Column(Container):
                     x = (self.width - entry.width) / 2
                 case constants.RIGHT:
                     x = self.width - entry.width
-            self.svg += Element("g", entry.svg, transform=f"translate({x}, {height})")
+            self.svg += Element(
+                "g", entry.get_svg(self), transform=f"translate({x}, {height})"
+            )
             height += entry.height + self.DEFAULT_PADDING
 
 
@@ -72,6 +72,12 @@ DEFAULT_PALETTE = [
     "yellowgreen",
 ]
 
+# Handling of overlapping labels.
+OVERLAP = "overlap"
+HIDE = "hide"
+STACK = "stack"
+LABEL_LAYOUTS = [OVERLAP, HIDE, STACK]
+
 ERROR = "error"
 WEDGE = "wedge"
 GRADIENT = "gradient"
@@ -2,19 +2,24 @@
 
 from icecream import ic
 
+import concurrent.futures
+import contextvars
 import datetime
+import gzip
+import io
 import json
 import pathlib
 import os
 import urllib.parse
+import weakref
 
-import requests
-import requests.exceptions
 import yaml
 
+import cache
 import constants
 import memo
 from minixml import Element
+import remote
 from vector2 import *
 import utils
 
@@ -42,6 +47,16 @@ class Diagram(Entity):
     DEFAULT_FONT_SIZE = 14
     DEFAULT_TITLE_FONT_SIZE = 18
 
+    # Attributes that may be set without making the built diagram invalid.
+    UNTRACKED_ATTRIBUTES = frozenset(["location"])
+
+    # State of the built diagram; instance attributes once changed.
+    _modified = True  # Must be built again.
+    _building = False  # Attributes set now do not make it modified.
+    _generation = 0  # Number of times built.
+    _containers = None  # Containers this diagram is part of.
+    _holder = None  # Container, and its generation, holding the SVG elements.
+
     def __init__(self, title=None, entries=None):
         assert title is None or isinstance(title, (str, dict))
         assert entries is None or isinstance(entries, (tuple, list))
@@ -49,13 +64,41 @@ class Diagram(Entity):
         self.title = title
         self.entries = []
         if entries:
-            for entry in entries:
+            for entry in self.resolve_includes(entries):
                 self.append(entry)
 
     def __iadd__(self, entry):
         self.append(entry)
         return self
 
+    def __setattr__(self, name, value):
+        "Setting an attribute, except when building, marks the diagram as modified."
+        super().__setattr__(name, value)
+        if not (
+            self._building or name.startswith("_") or name in self.UNTRACKED_ATTRIBUTES
+        ):
+            self.invalidate()
+
+    def invalidate(self):
+        """Mark the diagram as modified, so that it will be built again.
+        The containers it is part of are also marked as modified.
+        Must be called explicitly if an entry or attribute value has been
+        changed in place.
+        Always passed on to the containers, since a diagram that is marked as
+        modified may never have been built; its container may have been loaded
+        from the build cache.
+        """
+        self._modified = True
+        if self._containers is not None:
+            for container in list(self._containers.values()):
+                container.invalidate()
+
+    def add_container(self, container):
+        "Record that this diagram is part of the container."
+        if self._containers is None:
+            self._containers = weakref.WeakValueDictionary()
+        self._containers[id(container)] = container
+
     def append(self, entry):
         "Append the entry to the diagram."
         if isinstance(entry, dict):
@@ -63,11 +106,20 @@ class Diagram(Entity):
             entry = parse(*entry.popitem())
         self.check_entry(entry)
         self.entries.append(entry)
+        if isinstance(entry, Diagram):
+            entry.add_container(self)
+        self.invalidate()
 
     def check_entry(self, entry):
         "Check that the entry is valid for the diagram. Raise ValueError otherwise."
         raise NotImplementedError
 
+    def resolve_includes(self, entries):
+        """Return the entries with included locations replaced by diagrams.
+        To be reimplemented in diagrams that may include other diagrams.
+        """
+        return entries
+
     def data_as_dict(self):
         result = {}
         if self.title:
@@ -102,11 +154,58 @@ class Diagram(Entity):
                 result.append(entry.as_dict())
         return {"entries": result}
 
+    def get_subdiagrams(self):
+        "Return the diagrams directly contained in this diagram."
+        return [e for e in self.entries if isinstance(e, Diagram)]
+
+    def get_key_data(self):
+        """Return the data which determines the built diagram, for the cache key.
+        Included diagrams are given by their content, recursively, since
+        in 'as_dict' they are given only by their location. The class-level
+        settings are included, since changing any of them changes the build.
+        """
+        return [
+            self.as_dict(),
+            self.get_settings(),
+            [d.get_key_data() for d in self.get_subdiagrams()],
+        ]
+
+    def get_settings(self):
+        """Return the class-level settings, such as 'SHARED_DEFS'; the
+        upper-case attributes having simple values.
+        """
+        result = {}
+        for name in dir(self.__class__):
+            if name.isupper():
+                value = getattr(self.__class__, name)
+                if isinstance(value, (bool, int, float, str)):
+                    result[name] = value
+        return result
+
     def render(self, target=None, antialias=True, indent=2):
         """Render diagram and return SVG.
         If target is provided, write into file given by path or open file object.
+        The SVG is then written in chunks, without creating the full string.
+        A file path with suffix '.svgz' is written gzip-compressed.
         """
-        self.build()
+        document = self.get_document(antialias=antialias)
+        if isinstance(target, (str, pathlib.Path)):
+            if pathlib.Path(target).suffix == ".svgz":
+                with gzip.open(target, "wb") as outfile:
+                    document.write(outfile, indent=indent, xml_decl=True)
+            else:
+                with open(target, "w", encoding="utf-8") as outfile:
+                    document.write(outfile, indent=indent, xml_decl=True)
+        elif target is None:
+            outfile = io.StringIO()
+            document.write(outfile, indent=indent, xml_decl=True)
+            return outfile.getvalue()
+        else:
+            document.write(target, indent=indent, xml_decl=True)
+
+    def get_document(self, antialias=True):
+        "Build the diagram, if needed, and return the SVG document element tree."
+        self.build_cached()
         if antialias:
             extent = Vector2(self.width + 1, self.height + 1)
             transform = "translate(0.5, 0.5)"
@@ -121,26 +220,28 @@ class Diagram(Entity):
             viewBox=f"0 0 {utils.N(extent.x)} {utils.N(extent.y)}",
             transform=transform,
         )
-        document += self.svg
-        document.repr_indent = indent
-        if isinstance(target, (str, pathlib.Path)):
-            with open(target, "w") as outfile:
-                outfile.write(repr(document))
-        elif target is None:
-            return repr(document)
-        else:
-            target.write(repr(document))
+        # Definitions referred to from anywhere in the diagram, once only.
+        if defs := self.get_defs():
+            document += Element("defs", *[d.copy() for d in defs.values()])
+        document += self.get_svg()
+        return document
 
     def build(self):
         """Create the SVG elements in the 'svg' attribute. Adds the title, if given.
         Sets the 'svg' and 'height' attributes.
         Requires the 'width' attribute.
+        The definitions of the subdiagrams, which must already have been built,
+        are collected into those of this diagram. Thus a container loaded
+        from the build cache has them, without its subdiagrams being built.
         To be extended in subclasses.
         """
         self.height = 0
         assert hasattr(self, "width")
 
         self.svg = Element("g", stroke="black", fill="white")
+        self.defs = {}  # Key: id; value: definition element.
+        for subdiagram in self.get_subdiagrams():
+            self.defs.update(subdiagram.get_defs())
         self.svg["font-family"] = constants.DEFAULT_FONT_FAMILY
         self.svg["font-size"] = self.DEFAULT_FONT_SIZE
         if self.title:
@@ -174,6 +275,57 @@ class Diagram(Entity):
                     title["font-style"] = "italic"
             self.height += constants.DEFAULT_PADDING + constants.FONT_DESCEND * size
 
+    def build_cached(self):
+        """Build the diagram, unless it has not been modified since last built.
+        Set the 'svg', 'width' and 'height' attributes from the build cache
+        instead, if it is enabled and contains the built diagram.
+        """
+        if not self._modified:
+            return
+        self._generation += 1
+        self._building = True
+        try:
+            if (buildcache := cache.get()) is None:
+                self.build()
+            else:
+                # Key computed before building, which may set attributes.
+                key = buildcache.get_key(self)
+                if not buildcache.load(self, key=key):
+                    self.build()
+                    buildcache.store(self, key=key)
+        finally:
+            self._building = False
+        self._holder = None
+        self._modified = False
+
+    def get_defs(self):
+        """Return the definitions (gradients, markers) referred to in the built
+        SVG elements, including those of its subdiagrams. These are output once
+        in the document, not in the diagram.
+        """
+        return self.defs
+
+    def get_svg(self, container=None):
+        """Return the built SVG elements for inclusion in the container
+        being built, or in a document if no container.
+        If they are held by some other container, or already by this one,
+        then return a copy of them with new ids.
+        """
+        if self._holder is not None:
+            holder, generation = self._holder
+            holder = holder()
+            # The elements are in use if the holder has not been built since.
+            if holder is not None and holder._generation == generation:
+                svg = self.svg.copy()
+                cache.renew_ids(svg)
+                return svg
+        self.svg.free()
+        if container is None:
+            self._holder = None
+        else:
+            self._holder = (weakref.ref(container), container._generation)
+        return self.svg
+
     def save(self, target=None):
         """Output the diagram as YAML.
         If target is provided, write into file given by path or open file object.
@@ -185,7 +337,9 @@ class Diagram(Entity):
                 "version": constants.__version__,
                 "author": os.getlogin(),
                 "software": f"Neogram (Python) {constants.__version__}",
-                "timestamp": datetime.datetime.now(datetime.UTC).replace(microsecond=0).isoformat(),
+                "timestamp": datetime.datetime.now(datetime.UTC)
+                .replace(microsecond=0)
+                .isoformat(),
             }
         }
         data.update(self.as_dict())
@@ -220,24 +374,37 @@ class Container(Diagram):
 
         self.align = align or self.DEFAULT_ALIGN
 
-    def check_entry(self, entry):
+    def append(self, entry):
+        "Append the entry to the diagram."
         if isinstance(entry, str):
-            location = entry
-            reader = Reader(entry)
-            memo.check_add(reader)
-            try:
-                reader.read()
-                reader.read()
-                reader.parse_yaml()
-                reader.check_diagram_yaml()
-                entry = reader.get_diagram()
-                entry.location = location  # Record the location for later output.
-            except ValueError as error:
-                raise ValueError(f"error reading from '{reader}': {error}")
-            memo.remove(reader)
+            entry = include(entry)
+        super().append(entry)
+
+    def check_entry(self, entry):
         if not isinstance(entry, Diagram):
             raise ValueError(f"invalid entry for container: {entry}")
 
+    def resolve_includes(self, entries):
+        """Return the entries with included locations replaced by diagrams.
+        The locations are fetched concurrently. The entry is either the location
+        itself, or a dictionary with the kind of diagram and the location.
+        """
+        locations = {}  # Key: index of entry; value: location.
+        for i, entry in enumerate(entries):
+            if isinstance(entry, str):
+                locations[i] = entry
+            elif isinstance(entry, dict) and len(entry) == 1:
+                value = list(entry.values())[0]
+                if isinstance(value, str):
+                    locations[i] = value
+        if not locations:
+            return entries
+        result = list(entries)
+        readers = fetch(list(locations.values()))
+        for (i, location), reader in zip(locations.items(), readers):
+            result[i] = include(location, reader=reader)
+        return result
+
     def data_as_dict(self):
         result = super().data_as_dict()
         if self.align != self.DEFAULT_ALIGN:
@@ -248,6 +415,9 @@ class Container(Diagram):
 # Lookup for end-use classes. Key: name of class (lower case); value: class
 _entity_lookup = {}
 
+# Functions to call when an entity has been registered.
+_register_hooks = []
+
 
 def register(cls):
     "Register the diagram or entity for parsing."
@@ -256,6 +426,13 @@ def register(cls):
     if key in _entity_lookup:
         raise KeyError(f"entity '{key}' already registered")
     _entity_lookup[key] = cls
+    for func in _register_hooks:
+        func(cls)
+
+
+def add_register_hook(func):
+    "Add a function to be called with the class whenever an entity is registered."
+    _register_hooks.append(func)
 
 
 def parse(key, data):
@@ -267,27 +444,90 @@ def parse(key, data):
     if isinstance(data, dict):
         return cls(**data)
     elif isinstance(data, str):  # Get and parse YAML from the location.
-        location = data
-        reader = Reader(data)
+        return include(data)
+
+
+# Maximum number of locations to fetch concurrently.
+MAX_FETCH_WORKERS = 8
+
+# Diagrams already loaded, to use instead of reading their locations again.
+# Key: location as normalized by Reader; value: diagram.
+_reuse = contextvars.ContextVar("reuse", default={})
+
+
+def fetch(locations):
+    """Read, parse and check the YAML data at the locations concurrently.
+    Return a list, in the same order, of the Reader instance for each location,
+    or the ValueError if there was a problem.
+    """
+    reuse = _reuse.get()
+
+    def fetch_one(location):
+        reader = Reader(location)
+        if reader.location in reuse:  # No need to read it again.
+            return reader
         try:
             reader.read()
             reader.parse_yaml()
             reader.check_diagram_yaml()
-            entry = reader.get_diagram()
-            entry.location = location
-            return entry
         except ValueError as error:
-            raise ValueError(f"error reading from '{reader}': {error}")
+            return ValueError(f"error reading from '{reader}': {error}")
+        return reader
 
+    if len(locations) <= 1 or MAX_FETCH_WORKERS <= 1:
+        return [fetch_one(location) for location in locations]
+    workers = min(len(locations), MAX_FETCH_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch_one, locations))
 
-def retrieve(location):
+
+def include(location, reader=None):
+    """Return the diagram included from the location. If the reader is given,
+    it is the already fetched result for the location. Raise ValueError if any
+    problem, or if the location is already being included (a cycle).
+    """
+    if reader is None:
+        reader = fetch([location])[0]
+    if isinstance(reader, ValueError):
+        raise reader
+    try:
+        with memo.including(reader):
+            try:
+                entry = _reuse.get()[reader.location]
+            except KeyError:
+                entry = reader.get_diagram()
+    except ValueError as error:
+        raise ValueError(f"error reading from '{reader}': {error}")
+    entry.location = location  # Record the location for later output.
+    return entry
+
+
+def retrieve(location, reuse=None):
     """Read and parse the YAML file given by its path or URI.
+    If given, 'reuse' is a dictionary of already loaded diagrams keyed by
+    their normalized location, which are used instead of reading those
+    locations again when included.
     Return a Diagram instance.
     """
     reader = Reader(location)
     reader.read()
     reader.parse_yaml()
     reader.check_diagram_yaml()
+    token = _reuse.set({} if reuse is None else reuse)
+    try:
+        return reader.get_diagram()
+    finally:
+        _reuse.reset(token)
+
+
+def load(data):
+    """Parse the YAML data given as a string.
+    Return a Diagram instance.
+    """
+    reader = Reader("-")
+    reader.data = data
+    reader.parse_yaml()
+    reader.check_diagram_yaml()
     return reader.get_diagram()
 
 
@@ -318,12 +558,7 @@ class Reader:
             except OSError as error:
                 raise ValueError(str(error))
         else:
-            try:
-                response = requests.get(self.location)
-                response.raise_for_status()
-                self.data = response.text
-            except requests.exceptions.RequestException as error:
-                raise ValueError(str(error))
+            self.data = remote.fetch(self.location)
 
     def parse_yaml(self):
         "Parse the YAML data. Raise ValueError if any problem."
@@ -334,6 +569,7 @@ class Reader:
 
     def check_diagram_yaml(self):
         """Check that the YAML data is valid and prepare it for diagram parsing.
+        - The data is a mapping.
         - The software marker is present, which is removed.
         - The given version is compatible with the current version.
         - There is one and only one diagram instance in it.
@@ -342,6 +578,8 @@ class Reader:
         """
         import schema
 
+        if not isinstance(self.yaml, dict):
+            raise ValueError("YAML data is not a mapping")
         copy = self.yaml.copy()
         try:
             version = copy.pop("neogram")
@@ -356,7 +594,12 @@ class Reader:
         if len(copy) != 1:
             raise ValueError("YAML data contains more than one instance")
         # Schema validation must be done on the original data.
-        schema.validate(self.yaml)
+        # Not needed if this exact data has been validated before.
+        buildcache = cache.get()
+        if buildcache is None or not buildcache.is_valid(self.data):
+            schema.validate(self.yaml)
+            if buildcache is not None:
+                buildcache.set_valid(self.data)
         self.prepared = copy
 
     def get_diagram(self):
@@ -1,7 +1,7 @@
 "All currently defined diagram classes."
 
 # Imported for convenience.
-from diagram import retrieve
+from diagram import retrieve, load
 
 from timelines import *
 from piechart import *
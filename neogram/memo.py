@@ -1,34 +1,30 @@
-"""Singleton set for detecting cyclical references in YAML include operations.
-This probably won't work in multi-threaded situations.
+"""Detection of cyclical references in YAML include operations.
+The keys of the includes currently in progress are held in a context variable,
+so each thread and each asyncio task has its own chain of includes.
 """
 
-_memo = set()
+import contextlib
+import contextvars
 
+_including = contextvars.ContextVar("including", default=frozenset())
 
-def clear():
-    global _memo
-    _memo.clear()
 
-
-def check(key):
-    global _memo
-    key = repr(key)
-    if key in _memo:
-        raise ValueError
-
-
-def add(key):
-    global _memo
-    key = repr(key)
-    _memo.add(key)
-
-
-def check_add(key):
-    check(key)
-    add(key)
+def current():
+    "Return the keys of the includes in progress in the current context."
+    return _including.get()
 
 
-def remove(key):
-    global _memo
+@contextlib.contextmanager
+def including(key):
+    """Context manager marking the key as being included within the block.
+    Raise ValueError if it is already being included; a cycle.
+    """
     key = repr(key)
-    _memo.remove(key)
+    keys = _including.get()
+    if key in keys:
+        raise ValueError("cyclical include")
+    token = _including.set(keys | {key})
+    try:
+        yield
+    finally:
+        _including.reset(token)
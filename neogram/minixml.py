@@ -1,35 +1,74 @@
 "Minimalist XML library for reading, writing, creating and editing an element tree."
 
-__all__ = ["Element", "read", "parse"]
+__all__ = ["Element", "Output", "read", "parse"]
 
-import copy
 import io
+import re
+import sys
 import xml.sax
 import xml.sax.saxutils
 
 
+# Characters requiring escaping in attribute values and text content.
+_ATTR_SPECIAL = re.compile(r'[&<>"\n\r\t]')
+_TEXT_SPECIAL = re.compile(r"[&<>]")
+
+
+def quoteattr(value):
+    """Return the attribute value escaped and quoted.
+    Fast path for the very common case, e.g. numbers, of nothing to escape.
+    """
+    if _ATTR_SPECIAL.search(value) is None:
+        return f'"{value}"'
+    return xml.sax.saxutils.quoteattr(value)
+
+
+def escape(text):
+    """Return the text content escaped.
+    Fast path for the very common case of nothing to escape.
+    """
+    if _TEXT_SPECIAL.search(text) is None:
+        return text
+    return xml.sax.saxutils.escape(text)
+
+
 class Element:
-    "XML element. Contains a reference to superelement and subelements (if any)."
+    """XML element. Contains a reference to superelement and subelements (if any).
+    Compact: no instance dictionary, and the attributes dictionary and
+    subelements list are allocated only when needed.
+    """
+
+    __slots__ = ("tag", "_attrs", "superelement", "_subelements")
 
     repr_indent = 2
     xml_decl = True
 
     def __init__(self, tag, *subelements, **attrs):
         self.tag = tag
-        self.attrs = {}
+        self._attrs = None
         for name, value in attrs.items():
             self[name] = value
         self.superelement = None
-        self.subelements = []
+        self._subelements = None
         for subelement in subelements:
             self.append(subelement)
 
+    @classmethod
+    def from_attrs(cls, tag, attrs, *subelements):
+        """Create an element having the given dictionary of attributes,
+        which is used as is; all names and values must be strings.
+        Faster than the ordinary constructor when creating very many elements.
+        """
+        elem = cls(tag, *subelements)
+        elem._attrs = attrs
+        return elem
+
     def __str__(self):
         "Return the string representation of the element's starting tag."
         outfile = io.StringIO()
         outfile.write(f"<{self.tag}")
-        for name, value in self.attrs.items():
-            outfile.write(f" {name}={xml.sax.saxutils.quoteattr(value)}")
+        for name, value in (self._attrs or {}).items():
+            outfile.write(f" {name}={quoteattr(value)}")
         if len(self):
             outfile.write(">")
         else:
@@ -40,41 +79,47 @@ class Element:
         "Return the string representation of the element and its subelements."
         outfile = io.StringIO()
         self.write(
-            outfile, indent=self.repr_indent, xml_decl=self.xml_decl and self.depth == 0
+            outfile,
+            indent=self.repr_indent,
+            xml_decl=self.xml_decl and self.superelement is None,
         )
         return outfile.getvalue()
 
     def __getitem__(self, key):
         "Get the value of the attribute in this element."
         try:
-            return self.attrs[key]
-        except KeyError:
+            return self._attrs[key]
+        except (KeyError, TypeError):
             raise KeyError(f"no such attribute '{key}' in element")
 
     def __setitem__(self, key, value):
         "Set the value of the attribute in this element."
         if not isinstance(value, str):
             value = str(value)
-        self.attrs[key] = value
+        # Interned, since the same few attribute names are used over and over.
+        self.attrs[sys.intern(key)] = value
 
     def __delitem__(self, key):
         "Delete the attribute in this element."
         try:
-            del self.attrs[key]
-        except KeyError:
+            del self._attrs[key]
+        except (KeyError, TypeError):
             raise KeyError(f"no such attribute '{key}' in element")
 
     def __contains__(self, key):
         "Does this element have the given attribute?"
-        return key in self.attrs
+        return self._attrs is not None and key in self._attrs
 
     def __iter__(self):
         "Iterate over the subelements of this element."
-        yield from self.subelements
+        if self._subelements:
+            yield from self._subelements
 
     def __len__(self):
         "Return the number of subelements of this element."
-        return len(self.subelements)
+        if self._subelements is None:
+            return 0
+        return len(self._subelements)
 
     def __eq__(self, other):
         "Are the element and its subelements equal? Ignores the superelement."
@@ -82,11 +127,11 @@ class Element:
             return False
         if self.tag != other.tag:
             return False
-        if self.attrs != other.attrs:
+        if (self._attrs or {}) != (other._attrs or {}):
             return False
         if len(self) != len(other):
             return False
-        for subelement1, subelement2 in zip(self.subelements, other.subelements):
+        for subelement1, subelement2 in zip(self, other):
             if subelement1 != subelement2:
                 return False
         return True
@@ -106,6 +151,24 @@ class Element:
         "Set the value of the attribute in this element."
         self[key] = value
 
+    def items(self):
+        "Return the names and values of the attributes in this element."
+        return (self._attrs or {}).items()
+
+    @property
+    def attrs(self):
+        "Dictionary of the attributes of this element. Allocated when needed."
+        if self._attrs is None:
+            self._attrs = {}
+        return self._attrs
+
+    @property
+    def subelements(self):
+        "List of the subelements of this element. Allocated when needed."
+        if self._subelements is None:
+            self._subelements = []
+        return self._subelements
+
     @property
     def text(self):
         "Return the text content of this element. All non-blank texts are concatenated."
@@ -166,10 +229,22 @@ class Element:
 
     def copy(self):
         """Make a copy of this element and its subelements (i.e. deepcopy).
-        The returned element has no superelement.
+        The returned element has no superelement. The tree it is part of is
+        not copied. Much faster than 'copy.deepcopy'; the texts are shared.
         """
-        result = copy.deepcopy(self)
+        result = self.__class__.__new__(self.__class__)
+        result.tag = self.tag
+        result._attrs = None if self._attrs is None else self._attrs.copy()
         result.superelement = None
+        if self._subelements is None:
+            result._subelements = None
+        else:
+            result._subelements = []
+            for subelement in self._subelements:
+                if isinstance(subelement, Element):
+                    subelement = subelement.copy()
+                    subelement.superelement = result
+                result._subelements.append(subelement)
         return result
 
     def walk(self, test=None):
@@ -177,47 +252,118 @@ class Element:
         yielding those elements that match the given test function.
         If no test function given, yield all.
         """
-        if test is None or test(self):
-            yield self
-        for subelement in self:
-            if not isinstance(subelement, Element):
-                continue
-            yield from subelement.walk(test=test)
+        stack = [self]
+        while stack:
+            elem = stack.pop()
+            if test is None or test(elem):
+                yield elem
+            if elem._subelements:
+                stack.extend(
+                    reversed([e for e in elem._subelements if isinstance(e, Element)])
+                )
 
     def write(self, outfile, indent=None, xml_decl=False):
-        "Write the XML of the element and its subelements into the open file object."
-        if xml_decl:
-            outfile.write(f'<?xml version="1.0"?>\n')
-        if indent is None:
-            padding = ""
+        """Write the XML of the element and its subelements into the open file object.
+        The file object may be opened in text or binary mode. The output is
+        buffered in chunks, so that the full XML string is never created.
+        """
+        depth = self.depth
+        if isinstance(outfile, Output):
+            self._write(outfile, indent=indent, xml_decl=xml_decl, depth=depth)
         else:
-            padding = " " * indent * self.depth
-        outfile.write(padding)
-        outfile.write(f"<{self.tag}")
-        for name, value in self.attrs.items():
-            outfile.write(f" {name}={xml.sax.saxutils.quoteattr(value)}")
-        if len(self):
-            outfile.write(">")
-            newline = False
-            for elem in self:
-                if isinstance(elem, Element):
+            output = Output(outfile)
+            self._write(output, indent=indent, xml_decl=xml_decl, depth=depth)
+            output.flush()
+
+    def _write(self, outfile, indent=None, xml_decl=False, depth=0):
+        """Write the XML of the element and its subelements into the output.
+        Iterative rather than recursive, to handle deeply nested trees.
+        The depth is carried along, instead of computed for each element.
+        """
+        write = outfile.write
+        if xml_decl:
+            write(f'<?xml version="1.0"?>\n')
+        # Stack items: [element, depth, iterator over subelements, newline flag].
+        stack = [[self, depth, None, False]]
+        while stack:
+            item = stack[-1]
+            elem, depth, subelements = item[0], item[1], item[2]
+            if subelements is None:  # Starting tag not yet written.
+                if indent:
+                    write(" " * indent * depth)
+                if elem._attrs:
+                    attrs = "".join(
+                        [f" {n}={quoteattr(v)}" for n, v in elem._attrs.items()]
+                    )
+                else:
+                    attrs = ""
+                if not elem._subelements:
+                    write(f"<{elem.tag}{attrs} />")
+                    stack.pop()
+                    continue
+                write(f"<{elem.tag}{attrs}>")
+                item[2] = subelements = iter(elem._subelements)
+            for subelement in subelements:
+                if isinstance(subelement, Element):
                     if indent:
-                        outfile.write("\n")
-                    elem.write(outfile, indent=indent)
-                    newline = True
-                elif isinstance(elem, str):
-                    outfile.write(xml.sax.saxutils.escape(elem))
-                    newline = False
+                        write("\n")
+                    item[3] = True
+                    stack.append([subelement, depth + 1, None, False])
+                    break
+                elif isinstance(subelement, str):
+                    write(escape(subelement))
                 else:
-                    outfile.write(xml.sax.saxutils.escape(str(elem)))
-                    newline = False
-            if newline:
-                if indent:
-                    outfile.write("\n")
-                outfile.write(padding)
-            outfile.write(f"</{self.tag}>")
+                    write(escape(str(subelement)))
+                item[3] = False
+            else:  # All subelements written.
+                if item[3] and indent:
+                    write("\n")
+                    write(" " * indent * depth)
+                write(f"</{elem.tag}>")
+                stack.pop()
+
+
+def is_binary(outfile):
+    """Is the open file object explicitly in binary mode?
+    Anything else, e.g. some custom writer object, is given text.
+    """
+    if isinstance(outfile, (io.BufferedIOBase, io.RawIOBase)):
+        return True
+    mode = getattr(outfile, "mode", "")
+    return isinstance(mode, str) and "b" in mode
+
+
+class Output:
+    "Buffered output of text into an open file object in text or binary mode."
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, outfile, encoding="utf-8", chunk_size=None):
+        self.outfile = outfile
+        self.binary = is_binary(outfile)
+        self.encoding = encoding
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        "Add the text to the buffer. Write out the buffer if large enough."
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        "Write out the buffer to the file object."
+        if not self.chunks:
+            return
+        text = "".join(self.chunks)
+        if self.binary:
+            self.outfile.write(text.encode(self.encoding))
         else:
-            outfile.write(" />")
+            self.outfile.write(text)
+        self.chunks = []
+        self.size = 0
 
 
 class ContentHandler(xml.sax.ContentHandler):
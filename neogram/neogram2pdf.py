@@ -0,0 +1,60 @@
+"Convert Neogram YAML files to one PDF, having a page for each diagram."
+
+import pathlib
+import sys
+import time
+
+import click
+
+import lib
+from neogram_batch import get_infilepaths, validate_scale
+
+
+def get_pages(infilepaths, split=False):
+    """Yield the diagrams for the pages, reading the files one at a time.
+    If split, then each entry of a column diagram is a page of its own.
+    """
+    for infilepath in infilepaths:
+        try:
+            diagram = lib.retrieve(infilepath)
+        except ValueError as error:
+            raise ValueError(f"{infilepath}: {error}")
+        if split and isinstance(diagram, lib.Column):
+            yield from diagram.entries
+        else:
+            yield diagram
+
+
+@click.command()
+@click.option("-o", "--output", "outfilepath", required=True, help="PDF file.")
+@click.option("-s", "--scale", default=1.0, type=float, callback=validate_scale)
+@click.option(
+    "--split",
+    is_flag=True,
+    help="Output each entry of a column diagram as a page of its own.",
+)
+@click.argument("patterns", nargs=-1, required=True)
+def topdf(outfilepath, scale, split, patterns):
+    infilepaths = get_infilepaths(patterns)
+    if not infilepaths:
+        raise click.BadParameter("no input files found")
+    outfilepath = pathlib.Path(outfilepath)
+    # Imported only when needed; cairo is not needed for the help text.
+    import cairorender
+
+    start = time.perf_counter()
+    try:
+        pages = cairorender.write_pdf(
+            get_pages(infilepaths, split=split), outfilepath, scale=scale
+        )
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    seconds = time.perf_counter() - start
+    click.echo(
+        f"{outfilepath}: {pages} pages from {len(infilepaths)} files"
+        f" in {seconds:.3f} s; {pages / seconds:.1f} pages/s."
+    )
+
+
+if __name__ == "__main__":
+    topdf()
@@ -1,38 +1,306 @@
-"Convert Neogram YAML file to PNG."
+"Convert Neogram YAML file to PNG, or WebP."
 
+import concurrent.futures
 import io
+import os
 import pathlib
 import sys
+import time
 
-import cairosvg
 import click
+import PIL.Image
+import PIL.PngImagePlugin
 
 import lib
+import tiles
+from watch import Watcher
 
 
-def validate_scale(ctx, param, value):
-    if value <= 0.0:
+def validate_scales(ctx, param, value):
+    if not value:
+        return (1.0,)
+    if min(value) <= 0.0:
         raise click.BadParameter("scale must be larger than 0.0")
-    return value
+    return tuple(sorted(set(value)))
+
+
+def get_outfilepaths(infilepath, scales, template=None, suffix=".png"):
+    """Return a dictionary of the output file paths for the scales.
+    The template is formatted with the fields 'stem' (input file name without
+    suffix) and 'scale', e.g. '{stem}@{scale}x.png'. Without template,
+    the input file name with the given suffix for one scale, and that template
+    in the directory of the input file for several.
+    """
+    if template is None:
+        if len(scales) == 1:
+            return {scales[0]: infilepath.with_suffix(suffix)}
+        template = str(infilepath.parent / f"{{stem}}@{{scale}}x{suffix}")
+    elif len(scales) > 1 and "{scale}" not in template:
+        raise ValueError("output file name template must contain '{scale}'")
+    return dict(
+        [
+            (s, pathlib.Path(template.format(stem=infilepath.stem, scale=f"{s:g}")))
+            for s in scales
+        ]
+    )
 
 
 @click.command()
-@click.option("-s", "--scale", default=1.0, type=float, callback=validate_scale)
+@click.option(
+    "-s",
+    "--scale",
+    "scales",
+    multiple=True,
+    type=float,
+    callback=validate_scales,
+    help="Scale of the output. May be given several times.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Render again whenever the input file or its included files change.",
+)
+@click.option(
+    "-d",
+    "--direct",
+    is_flag=True,
+    help="Draw directly with cairo, instead of via SVG text and cairosvg.",
+)
+@click.option(
+    "--tile-size",
+    type=click.IntRange(min=16),
+    help="Output tiles of this size in pixels into a directory, instead of one PNG.",
+)
+@click.option(
+    "--zoom",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of zoom levels of tiles below the given scale, each half the size.",
+)
+@click.option(
+    "--parallel",
+    is_flag=True,
+    help="Rasterize several scales in parallel processes.",
+)
+@click.option("--workers", default=os.cpu_count(), type=click.IntRange(min=1))
+@click.option(
+    "--format",
+    "format",
+    default="png",
+    type=click.Choice(["png", "webp"]),
+    help="Output format. WebP is written lossless.",
+)
+@click.option(
+    "--colors",
+    type=click.IntRange(min=2, max=256),
+    help="Quantize to a palette of at most this number of colors.",
+)
+@click.option(
+    "--compression",
+    type=click.IntRange(min=0, max=9),
+    help="Compression level; zlib for PNG, effort for WebP.",
+)
+@click.option("--strip", is_flag=True, help="Strip metadata from the output.")
 @click.argument("infilepath", nargs=1, required=True)
 @click.argument("outfilepath", nargs=1, required=False)
-def topng(scale, infilepath, outfilepath):
+def topng(
+    scales,
+    watch,
+    direct,
+    tile_size,
+    zoom,
+    parallel,
+    workers,
+    format,
+    colors,
+    compression,
+    strip,
+    infilepath,
+    outfilepath,
+):
     infilepath = pathlib.Path(infilepath)
     if not infilepath.exists():
         raise click.BadParameter("no such input file")
+    if format != "png" or colors or compression is not None or strip:
+        encoding = dict(
+            format=format, colors=colors, compression=compression, strip=strip
+        )
+    else:
+        encoding = None
+    if tile_size:
+        if watch:
+            raise click.BadParameter("cannot watch when output as tiles")
+        if len(scales) > 1:
+            raise click.BadParameter("only one scale when output as tiles")
+        if encoding:
+            raise click.BadParameter("no format options when output as tiles")
+        scale = scales[0]
+        try:
+            diagram = lib.retrieve(infilepath)
+        except ValueError as error:
+            sys.exit(f"Error: {error}")
+        outdirpath = outfilepath or infilepath.with_suffix("")
+        start = time.perf_counter()
+        count = tiles.write_tiles(
+            diagram,
+            outdirpath,
+            scale=scale,
+            size=tile_size,
+            zoom=zoom,
+            workers=workers,
+            direct=direct,
+        )
+        seconds = time.perf_counter() - start
+        click.echo(
+            f"{outdirpath}: {count} tiles in {seconds:.3f} s using {workers} workers."
+        )
+        return
+    try:
+        outfilepaths = get_outfilepaths(
+            infilepath, scales, template=outfilepath, suffix=f".{format}"
+        )
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    workers = workers if parallel else 1
+    if watch:
+        click.echo(f"Watching {infilepath}; interrupt to stop.")
+        try:
+            Watcher(infilepath).run(
+                lambda diagram: write_pngs(
+                    diagram,
+                    outfilepaths,
+                    direct=direct,
+                    workers=workers,
+                    encoding=encoding,
+                ),
+                report=click.echo,
+            )
+        except KeyboardInterrupt:
+            pass
+        return
     try:
         diagram = lib.retrieve(infilepath)
     except ValueError as error:
         sys.exit(f"Error: {error}")
-    if not outfilepath:
-        outfilepath = infilepath.with_suffix(".png")
-    svgfile = io.StringIO(diagram.render())
+    write_pngs(diagram, outfilepaths, direct=direct, workers=workers, encoding=encoding)
+
+
+def get_png(diagram, scale=1.0, direct=False, encoding=None):
+    """Render the diagram and return the PNG data.
+    If direct, then draw the built elements with cairo, without SVG text.
+    If encoding options are given, then re-encode the data accordingly.
+    """
+    # Imported only when needed; cairo is not needed for re-encoding.
+    if direct:
+        import cairorender
+
+        data = cairorender.get_png(diagram, scale=scale)
+    else:
+        import cairosvg
+
+        svgfile = io.StringIO(diagram.render())
+        data = cairosvg.svg2png(file_obj=svgfile, scale=scale)
+    if encoding:
+        data = encode(data, **encoding)
+    return data
+
+
+def write_png(diagram, outfilepath, scale=1.0, direct=False, encoding=None):
+    "Render the diagram and write it as PNG to the file."
+    with open(outfilepath, "wb") as outfile:
+        outfile.write(get_png(diagram, scale=scale, direct=direct, encoding=encoding))
+
+
+def encode(data, format="png", colors=None, compression=None, strip=False):
+    """Re-encode the PNG data using Pillow, and return the data.
+    Quantizing to a palette makes the mostly flat colors of diagrams compress
+    much better. The compression level is that of zlib for PNG, and is scaled
+    to the effort for lossless WebP. Stripping removes the text chunks,
+    resolution and color profile.
+    """
+    image = PIL.Image.open(io.BytesIO(data))
+    params = {}
+    if not strip:
+        if "icc_profile" in image.info:
+            params["icc_profile"] = image.info["icc_profile"]
+        if format == "png":
+            if "dpi" in image.info:
+                params["dpi"] = image.info["dpi"]
+            if image.text:
+                params["pnginfo"] = PIL.PngImagePlugin.PngInfo()
+                for key, value in image.text.items():
+                    params["pnginfo"].add_text(key, value)
+    if colors:
+        # The fast octree method is the one that handles transparency.
+        image = image.quantize(colors=colors, method=PIL.Image.Quantize.FASTOCTREE)
+    if format == "webp":
+        params["lossless"] = True
+        if compression is not None:
+            params["quality"] = round(100 * compression / 9)
+    elif compression is not None:
+        params["compress_level"] = compression
+    outfile = io.BytesIO()
+    image.save(outfile, format=format, **params)
+    return outfile.getvalue()
+
+
+def write_pngs(diagram, outfilepaths, direct=False, workers=1, encoding=None):
+    """Render the diagram and write it as PNG at several scales to the files
+    given by the dictionary of scale to file path. The diagram is built and
+    its SVG text produced once for all scales. If more than one worker,
+    the scales are rasterized in parallel processes.
+    If encoding options are given, then each output is re-encoded accordingly.
+    """
+    if direct:
+        source = diagram.get_document()
+    else:
+        source = diagram.render()
+    items = list(outfilepaths.items())
+    workers = min(workers, len(items))
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(source, direct)
+        ) as executor:
+            futures = [executor.submit(write_scaled, p, s, encoding) for s, p in items]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    else:
+        init_worker(source, direct)
+        for scale, outfilepath in items:
+            write_scaled(outfilepath, scale, encoding=encoding)
+
+
+# State of the process rasterizing scales; the SVG text or the document.
+_worker = {}
+
+
+def init_worker(source, direct):
+    "Set up for rasterizing the SVG text or, if direct, the document."
+    _worker["direct"] = direct
+    if direct:
+        _worker["document"] = source
+    else:
+        _worker["svg"] = source.encode("utf-8")
+
+
+def write_scaled(outfilepath, scale, encoding=None):
+    """Rasterize at the given scale, and write it as PNG to the file.
+    If encoding options are given, then re-encode the data accordingly.
+    """
+    if _worker["direct"]:
+        import cairorender
+
+        data = cairorender.get_document_png(_worker["document"], scale=scale)
+    else:
+        import cairosvg
+
+        # Parsed for each scale; cairosvg modifies the tree when drawing it.
+        data = cairosvg.svg2png(bytestring=_worker["svg"], scale=scale)
+    if encoding:
+        data = encode(data, **encoding)
     with open(outfilepath, "wb") as outfile:
-        outfile.write(cairosvg.svg2png(file_obj=svgfile, scale=scale))
+        outfile.write(data)
+    return outfilepath
 
 
 if __name__ == "__main__":
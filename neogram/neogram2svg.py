@@ -5,24 +5,69 @@ import sys
 
 import click
 
+import cache
 import lib
+import remote
+from watch import Watcher
 
 
 @click.command()
 @click.option("-i", "--indent", default=2, type=int)
+@click.option("-z", "--gzip", is_flag=True, help="Default output file is '.svgz'.")
+@click.option(
+    "-c",
+    "--cache",
+    "cachedir",
+    type=click.Path(file_okay=False),
+    help="Directory for cache of built diagrams.",
+)
+@click.option(
+    "--http-cache",
+    "httpcachedir",
+    type=click.Path(file_okay=False),
+    help="Directory for cache of remote includes.",
+)
+@click.option(
+    "-t",
+    "--timeout",
+    default=remote.DEFAULT_TIMEOUT,
+    type=float,
+    help="Timeout for remote includes, in seconds.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Render again whenever the input file or its included files change.",
+)
 @click.argument("infilepath", nargs=1, required=True)
 @click.argument("outfilepath", nargs=1, required=False)
-def tosvg(indent, infilepath, outfilepath):
+def tosvg(
+    indent, gzip, cachedir, httpcachedir, timeout, watch, infilepath, outfilepath
+):
     infilepath = pathlib.Path(infilepath)
     if not infilepath.exists():
         raise click.BadParameter("no such input file")
+    if cachedir:
+        cache.enable(cachedir)
+    remote.configure(cachedir=httpcachedir, timeout=timeout)
+    if not outfilepath:
+        outfilepath = infilepath.with_suffix(".svgz" if gzip else ".svg")
+    indent = max(0, indent)
+    if watch:
+        click.echo(f"Watching {infilepath}; interrupt to stop.")
+        try:
+            Watcher(infilepath).run(
+                lambda diagram: diagram.render(outfilepath, indent=indent),
+                report=click.echo,
+            )
+        except KeyboardInterrupt:
+            pass
+        return
     try:
         diagram = lib.retrieve(infilepath)
     except ValueError as error:
         sys.exit(f"Error: {error}")
-    if not outfilepath:
-        outfilepath = infilepath.with_suffix(".svg")
-    diagram.render(outfilepath, indent=max(0, indent))
+    diagram.render(outfilepath, indent=indent)
 
 
 if __name__ == "__main__":
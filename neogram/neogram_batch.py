@@ -0,0 +1,151 @@
+"Convert many Neogram YAML files to SVG and/or PNG using parallel processes."
+
+import concurrent.futures
+import glob
+import os
+import pathlib
+import sys
+import time
+
+import click
+
+import cache
+import lib
+
+
+def get_infilepaths(patterns):
+    "Return the sorted YAML file paths given by file paths, directories or globs."
+    result = set()
+    for pattern in patterns:
+        path = pathlib.Path(pattern)
+        if path.is_dir():
+            result.update(path.rglob("*.yaml"))
+        elif path.is_file():
+            result.add(path)
+        else:
+            result.update([pathlib.Path(p) for p in glob.glob(pattern, recursive=True)])
+    return sorted(result)
+
+
+def validate_scale(ctx, param, value):
+    if value <= 0.0:
+        raise click.BadParameter("scale must be larger than 0.0")
+    return value
+
+
+def is_uptodate(infilepath, outfilepath):
+    "Is the output file newer than the input file?"
+    try:
+        return outfilepath.stat().st_mtime > infilepath.stat().st_mtime
+    except OSError:
+        return False
+
+
+def render(infilepath, suffixes, scale=1.0, indent=2, force=False, cachedir=None):
+    """Render the YAML file into output files with the given suffixes.
+    Output files newer than the input file are skipped, unless forced.
+    Return tuple (list of output file paths written, seconds, error message,
+    cache statistics).
+    """
+    start = time.perf_counter()
+    outfilepaths = [infilepath.with_suffix(s) for s in suffixes]
+    if not force:
+        outfilepaths = [p for p in outfilepaths if not is_uptodate(infilepath, p)]
+    if not outfilepaths:
+        return [], time.perf_counter() - start, None, {}
+    if cachedir:
+        if (buildcache := cache.get()) is None:
+            buildcache = cache.enable(cachedir)
+        buildcache.reset_stats()
+    try:
+        diagram = lib.retrieve(infilepath)
+        for outfilepath in outfilepaths:
+            if outfilepath.suffix == ".png":
+                # Imported only when needed, since cairosvg is slow to import.
+                import neogram2png
+
+                neogram2png.write_png(diagram, outfilepath, scale=scale)
+            else:
+                diagram.render(outfilepath, indent=indent)
+    except (ValueError, OSError) as error:
+        return [], time.perf_counter() - start, str(error), {}
+    stats = cache.get().stats if cachedir else {}
+    return outfilepaths, time.perf_counter() - start, None, stats
+
+
+@click.command()
+@click.option("--svg/--no-svg", default=True, help="Output SVG file.")
+@click.option("--png/--no-png", default=False, help="Output PNG file.")
+@click.option("-s", "--scale", default=1.0, type=float, callback=validate_scale)
+@click.option("-i", "--indent", default=2, type=int)
+@click.option("-w", "--workers", default=os.cpu_count(), type=click.IntRange(min=1))
+@click.option("-f", "--force", is_flag=True, help="Render even if outputs are newer.")
+@click.option(
+    "-c",
+    "--cache",
+    "cachedir",
+    type=click.Path(file_okay=False),
+    help="Directory for cache of built diagrams.",
+)
+@click.argument("patterns", nargs=-1, required=True)
+def batch(svg, png, scale, indent, workers, force, cachedir, patterns):
+    suffixes = []
+    if svg:
+        suffixes.append(".svg")
+    if png:
+        suffixes.append(".png")
+    if not suffixes:
+        raise click.BadParameter("no output format given")
+    infilepaths = get_infilepaths(patterns)
+    if not infilepaths:
+        raise click.BadParameter("no input files found")
+
+    start = time.perf_counter()
+    rendered = skipped = 0
+    failures = []
+    cache_hits = cache_misses = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = dict(
+            [
+                (
+                    executor.submit(
+                        render, p, suffixes, scale, max(0, indent), force, cachedir
+                    ),
+                    p,
+                )
+                for p in infilepaths
+            ]
+        )
+        for future in concurrent.futures.as_completed(futures):
+            infilepath = futures[future]
+            try:
+                outfilepaths, seconds, error, stats = future.result()
+            except Exception as exception:  # E.g. worker process died.
+                outfilepaths, seconds, error, stats = [], 0.0, repr(exception), {}
+            cache_hits += stats.get("hits", 0)
+            cache_misses += stats.get("misses", 0)
+            if error:
+                failures.append((infilepath, error))
+                click.echo(f"{infilepath}: FAILED ({seconds:.3f} s): {error}")
+            elif outfilepaths:
+                rendered += 1
+                click.echo(f"{infilepath}: {seconds:.3f} s")
+            else:
+                skipped += 1
+                click.echo(f"{infilepath}: up to date")
+    seconds = time.perf_counter() - start
+
+    click.echo(
+        f"{len(infilepaths)} files in {seconds:.3f} s using {workers} workers:"
+        f" {rendered} rendered, {skipped} skipped, {len(failures)} failed."
+    )
+    if cachedir:
+        click.echo(f"Cache: {cache_hits} hits, {cache_misses} misses.")
+    for infilepath, error in failures:
+        click.echo(f"  {infilepath}: {error}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    batch()
@@ -0,0 +1,215 @@
+"Local HTTP server rendering Neogram YAML to SVG or PNG, with warm imports."
+
+import concurrent.futures
+import http.server
+import multiprocessing
+import os
+import signal
+import threading
+import urllib.parse
+
+import click
+
+import constants
+import lib
+import schema
+
+PNG_CONTENT_TYPE = "image/png"
+
+
+def warm(pids):
+    """Compile and cache the schema validator. Done once in each worker process.
+    Report the id of the worker process to the server, for terminating it.
+    """
+    pids.put(os.getpid())
+    schema.get_validator(schema.SCHEMA)
+
+
+def render(data, format="svg", scale=1.0):
+    """Render the YAML data into SVG or PNG.
+    Return tuple (content type, content bytes).
+    Raise ValueError if any problem with the data.
+    """
+    diagram = lib.load(data)
+    if format == "png":
+        # Imported only when needed, since cairosvg is slow to import.
+        import neogram2png
+
+        return PNG_CONTENT_TYPE, neogram2png.get_png(diagram, scale=scale)
+    else:
+        return constants.SVG_CONTENT_TYPE, diagram.render().encode("utf-8")
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle POST of YAML to '/svg' or '/png'. The path '/' is the same as '/svg'.
+    For PNG, the query parameter 'scale' may be given.
+    """
+
+    def do_POST(self):
+        parts = urllib.parse.urlparse(self.path)
+        format = parts.path.strip("/") or "svg"
+        if format not in ("svg", "png"):
+            self.send_error(404, f"no such format '{format}'")
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type != constants.YAML_CONTENT_TYPE:
+            self.send_error(415, f"content type must be {constants.YAML_CONTENT_TYPE}")
+            return
+        try:
+            scale = float(urllib.parse.parse_qs(parts.query).get("scale", ["1"])[0])
+            if scale <= 0.0:
+                raise ValueError
+        except ValueError:
+            self.send_error(400, "scale must be a number larger than 0.0")
+            return
+        try:
+            length = int(self.headers["Content-Length"])
+        except (KeyError, ValueError):
+            self.send_error(411)
+            return
+        try:
+            data = self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError:
+            self.send_error(400, "data must be UTF-8 encoded")
+            return
+
+        executor, future = self.server.submit(render, data, format, scale)
+        try:
+            content_type, content = future.result(timeout=self.server.render_timeout)
+        except concurrent.futures.TimeoutError:
+            # A render already started cannot be stopped; its worker is stuck.
+            self.server.recycle(executor, future)
+            self.send_error(504, "rendering timed out")
+            return
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+        except Exception as error:
+            self.send_error(500, repr(error))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server handing over rendering to a pool of worker processes.
+    The workers are forked from this process after the imports have been done,
+    and the schema validator is compiled once in each of them.
+    A pool having a worker stuck with a render that timed out is replaced.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8000, workers=None, timeout=30.0):
+        super().__init__((host, port), RequestHandler)
+        self.render_timeout = timeout
+        self.verbose = False
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pids = {}  # Key: executor; value: queue of its worker process ids.
+        self.executor = self.create_executor()
+        # Key: executor; value: its futures not yet done.
+        self.futures = {self.executor: set()}
+        self.stuck = {}  # Key: executor; value: futures that timed out.
+
+    def create_executor(self):
+        """Create a pool of worker processes. Each worker reports its process id,
+        since the pool does not give access to its processes.
+        """
+        pids = multiprocessing.SimpleQueue()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=warm, initargs=(pids,)
+        )
+        self.pids[executor] = pids
+        return executor
+
+    def submit(self, *args):
+        "Submit the render to the current pool. Return the pool and the future."
+        with self.lock:
+            executor = self.executor
+            future = executor.submit(*args)
+            self.futures[executor].add(future)
+        future.add_done_callback(lambda f: self.done(executor, f))
+        return executor, future
+
+    def done(self, executor, future):
+        "The render has finished. Terminate its pool if retired and now idle."
+        with self.lock:
+            self.futures.get(executor, set()).discard(future)
+        self.reap(executor)
+
+    def recycle(self, executor, future):
+        """The render has timed out, and its worker is stuck with it.
+        Replace the pool by a new one for later renders. The old pool is
+        terminated when the renders in it which have not timed out are done.
+        """
+        with self.lock:
+            self.stuck.setdefault(executor, set()).add(future)
+            if executor is self.executor:
+                self.executor = self.create_executor()
+                self.futures[self.executor] = set()
+        self.reap(executor)
+
+    def reap(self, executor):
+        "Terminate the pool if it is retired and only has stuck renders left."
+        with self.lock:
+            if executor is self.executor or executor not in self.futures:
+                return
+            if self.futures[executor] - self.stuck.get(executor, set()):
+                return
+            self.futures.pop(executor)
+            self.stuck.pop(executor, None)
+            pids = self.pids.pop(executor)
+        terminate(executor, pids)
+
+    def server_close(self):
+        super().server_close()
+        with self.lock:
+            retired = [
+                (e, self.pids.pop(e)) for e in self.futures if e is not self.executor
+            ]
+            self.futures = {}
+        for executor, pids in retired:
+            terminate(executor, pids)
+        self.executor.shutdown(cancel_futures=True)
+
+
+def terminate(executor, pids):
+    """Stop the worker processes of the pool, also any busy with a render.
+    Their process ids are those reported by the workers in the queue.
+    """
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGTERM)
+        except ProcessLookupError:  # Already exited.
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@click.command()
+@click.option("-h", "--host", default="127.0.0.1")
+@click.option("-p", "--port", default=8000, type=int)
+@click.option("-w", "--workers", default=os.cpu_count(), type=click.IntRange(min=1))
+@click.option("-t", "--timeout", default=30.0, type=float, help="Seconds per request.")
+@click.option("-v", "--verbose", is_flag=True, help="Log each request.")
+def serve(host, port, workers, timeout, verbose):
+    server = Server(host=host, port=port, workers=workers, timeout=timeout)
+    server.verbose = verbose
+    click.echo(f"Serving on http://{host}:{server.server_port}/ ({workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
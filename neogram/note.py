@@ -118,6 +118,8 @@ class Note(Diagram):
             result["body"] = self.body
         if self.footer:
             result["footer"] = self.footer
+        if self.width != self.DEFAULT_WIDTH:
+            result["width"] = self.width
         if self.frame != self.DEFAULT_FRAME:
             result["frame"] = self.frame
         if self.color != self.DEFAULT_COLOR:
@@ -0,0 +1,117 @@
+"""Fetch data from remote locations by HTTP.
+A shared session is used, so that connections are kept alive and reused.
+Responses having ETag or Last-Modified are stored in a cache directory,
+if set, and later requests for the same URL are made conditional.
+"""
+
+import hashlib
+import json
+import pathlib
+import threading
+
+import requests
+import requests.adapters
+import requests.exceptions
+import urllib3.util
+
+DEFAULT_TIMEOUT = 10.0  # Seconds.
+DEFAULT_RETRIES = 2
+
+# Current settings; changed by 'configure'.
+_settings = dict(cachedir=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES)
+
+_session = None
+_lock = threading.Lock()
+
+# Statistics of requests; mainly for testing.
+stats = dict(requests=0, not_modified=0)
+
+
+def configure(cachedir=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """Set the cache directory, the timeout (seconds) and the number of retries
+    for connection errors and some server errors.
+    """
+    global _session
+    assert timeout is None or (isinstance(timeout, (int, float)) and timeout > 0)
+    assert isinstance(retries, int) and retries >= 0
+    with _lock:
+        if cachedir is not None:
+            cachedir = pathlib.Path(cachedir)
+            cachedir.mkdir(parents=True, exist_ok=True)
+        _settings["cachedir"] = cachedir
+        _settings["timeout"] = timeout
+        _settings["retries"] = retries
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session():
+    "Return the shared session, creating it if needed."
+    global _session
+    with _lock:
+        if _session is None:
+            retry = urllib3.util.Retry(
+                total=_settings["retries"],
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET"],
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=8, pool_maxsize=32, max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def get_cache_filepath(url):
+    "Return the path of the cache file for the URL, or None if no cache."
+    if _settings["cachedir"] is None:
+        return None
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return _settings["cachedir"].joinpath(key).with_suffix(".json")
+
+
+def fetch(url):
+    """Return the text data at the URL.
+    Use the cached data if the server says it has not been modified.
+    Raise ValueError if any problem.
+    """
+    filepath = get_cache_filepath(url)
+    cached = None
+    headers = {}
+    if filepath is not None:
+        try:
+            with open(filepath) as infile:
+                cached = json.load(infile)
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        except (OSError, ValueError):
+            cached = None
+    try:
+        with _lock:
+            stats["requests"] += 1
+        response = get_session().get(url, headers=headers, timeout=_settings["timeout"])
+        if response.status_code == 304 and cached is not None:
+            with _lock:
+                stats["not_modified"] += 1
+            return cached["text"]
+        response.raise_for_status()
+    except requests.exceptions.RequestException as error:
+        raise ValueError(str(error))
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if filepath is not None and (etag or last_modified):
+        cached = dict(
+            url=url, etag=etag, last_modified=last_modified, text=response.text
+        )
+        try:
+            with open(filepath, "w") as outfile:
+                json.dump(cached, outfile)
+        except OSError:
+            pass
+    return response.text
@@ -53,7 +53,7 @@ class Row(Container):
         Sets the 'width' attribute.
         """
         for entry in self.entries:
-            entry.build()
+            entry.build_cached()
 
         self.width = sum([e.width for e in self.entries])
         self.width += (len(self.entries) - 1) * self.DEFAULT_PADDING
@@ -72,7 +72,9 @@ class Row(Container):
                     y = self.height + (max_height - entry.height) / 2
                 case constants.TOP:
                     y = self.height
-            self.svg += Element("g", entry.svg, transform=f"translate({x}, {y})")
+            self.svg += Element(
+                "g", entry.get_svg(self), transform=f"translate({x}, {y})"
+            )
             x += entry.width + self.DEFAULT_PADDING
 
         self.height += max_height
@@ -3,10 +3,13 @@
 import json
 
 import jsonschema
+import referencing
+import referencing.jsonschema
 
 # import webcolors
 
 import constants
+import diagram
 import lib
 
 
@@ -226,7 +229,33 @@ SCHEMA = {
 }
 
 
+# Cache of compiled validators. Key: id of schema; value: (schema, validator).
+# The schema itself is kept in the value, so that its id cannot be reused.
+_validators = {}
+
+
+def clear_validators(*args):
+    "Clear the validator cache. Must be done when the schema has been modified."
+    _validators.clear()
+
+
+# Registering a diagram class may modify the schema.
+diagram.add_register_hook(clear_validators)
+
+
 def get_validator(schema):
+    "Return the validator for the schema. Compiled once, then cached."
+    try:
+        return _validators[id(schema)][1]
+    except KeyError:
+        pass
+    validator = create_validator(schema)
+    _validators[id(schema)] = (schema, validator)
+    return validator
+
+
+def create_validator(schema):
+    "Create a new validator for the schema."
     format_checker = jsonschema.FormatChecker(["color", "uri-reference"])
 
     # How to add more checkers:
@@ -241,7 +270,15 @@ def get_validator(schema):
     #             return False
     #     return True
 
-    return jsonschema.Draft202012Validator(schema=schema, format_checker=format_checker)
+    # Crawl the schema up front, so that '$anchor' references are resolved
+    # from the registry instead of by a new crawl of the schema for each lookup.
+    registry = referencing.Registry().with_resource(
+        schema.get("$id", ""),
+        referencing.jsonschema.DRAFT202012.create_resource(schema),
+    )
+    return jsonschema.Draft202012Validator(
+        schema=schema, format_checker=format_checker, registry=registry.crawl()
+    )
 
 
 def check_schema(schema):
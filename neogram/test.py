@@ -2,9 +2,23 @@
 
 from icecream import ic
 
+import concurrent.futures
+import hashlib
+import http.server
+import io
 import os
+import pathlib
+import re
+import tempfile
+import threading
+import time
 
+import cache
+import constants
 from lib import *
+import memo
+import remote
+import watch
 
 
 TESTS = {
@@ -279,6 +293,893 @@ def test_poster():
     poster.save("poster.yaml")
 
 
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    """Stand-in for a remote server, serving files from the current directory.
+    Supports ETag. Paths starting with '/slow/' are delayed one second.
+    """
+
+    def do_GET(self):
+        path = self.path
+        if path.startswith("/slow/"):
+            time.sleep(1)
+            path = path[len("/slow") :]
+        try:
+            self.respond(path)
+        except (BrokenPipeError, ConnectionResetError):  # Client timed out.
+            pass
+
+    def respond(self, path):
+        try:
+            with open(self.translate_path(path), "rb") as infile:
+                data = infile.read()
+        except OSError:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", constants.YAML_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_render_targets():
+    "Rendering into binary files, text files and any object having 'write'."
+
+    class Writer:
+        def __init__(self):
+            self.parts = []
+
+        def write(self, text):
+            assert isinstance(text, str)
+            self.parts.append(text)
+
+    diagram = get_universe()
+    svg = diagram.render()
+    writer = Writer()
+    diagram.render(writer)
+    assert "".join(writer.parts) == svg
+    outfile = io.StringIO()
+    diagram.render(outfile)
+    assert outfile.getvalue() == svg
+    outfile = io.BytesIO()
+    diagram.render(outfile)
+    assert outfile.getvalue() == svg.encode("utf-8")
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = pathlib.Path(dirpath) / "universe.svg"
+        with open(filepath, "wb") as outfile:
+            diagram.render(outfile)
+        assert filepath.read_text(encoding="utf-8") == svg
+
+
+def test_remote():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with tempfile.TemporaryDirectory() as cachedir:
+            remote.configure(cachedir=cachedir, timeout=0.5, retries=0)
+            pyramid = retrieve(f"{url}/pyramid.yaml")
+            assert pyramid == retrieve("pyramid.yaml")
+
+            # The same remote file again; not modified, so taken from the cache.
+            not_modified = remote.stats["not_modified"]
+            column = Column(
+                entries=[
+                    {"piechart": f"{url}/pyramid.yaml"},
+                    {"note": f"{url}/declaration.yaml"},
+                ]
+            )
+            assert column.entries[0] == pyramid
+            assert remote.stats["not_modified"] == not_modified + 1
+
+            try:
+                retrieve(f"{url}/no_such_file.yaml")
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("no error for missing remote file")
+
+            try:
+                retrieve(f"{url}/slow/pyramid.yaml")
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("no error for timeout")
+    finally:
+        remote.configure()
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve():
+    "Bad requests are refused, and a timed-out render does not block others."
+    import multiprocessing
+    import urllib.error
+    import urllib.request
+
+    import neogram_serve
+
+    server = neogram_serve.Server(port=0, workers=1, timeout=0.5)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/svg"
+
+    def post(data):
+        request = urllib.request.Request(
+            url, data=data, headers={"Content-Type": constants.YAML_CONTENT_TYPE}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    try:
+        assert post(b"neogram: null\nnote:\n  body: \xff\n") == 400
+        assert post(b"- neogram\n- note\n") == 400
+        # Takes very much longer than the timeout.
+        entries = "".join(
+            [f"  - event: {{label: E{i}, instant: {i}}}\n" for i in range(20000)]
+        )
+        slow = f"neogram: null\ntimelines:\n  entries:\n{entries}"
+        workers = set([p.pid for p in multiprocessing.active_children()])
+        assert workers
+        assert post(slow.encode("utf-8")) == 504
+        # The stuck worker process is terminated.
+        for i in range(50):
+            if not workers.intersection(
+                [p.pid for p in multiprocessing.active_children()]
+            ):
+                break
+            time.sleep(0.1)
+        else:
+            raise AssertionError("stuck worker not terminated")
+        server.render_timeout = 5.0
+        with open("pyramid.yaml", "rb") as infile:
+            assert post(infile.read()) == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_includes(depth=10, loads=200):
+    "Load many interlinked diagrams, some of them cyclical, from many threads."
+    with tempfile.TemporaryDirectory() as dirpath:
+        dirpath = pathlib.Path(dirpath)
+        note = dirpath / "note.yaml"
+        note.write_text("neogram: null\nnote:\n  body: Leaf\n")
+        # A chain of columns, each including a note and the next column.
+        for i in range(depth):
+            entries = f"  - note: {note}\n"
+            if i + 1 < depth:
+                entries += f"  - column: {dirpath / f'chain{i + 1}.yaml'}\n"
+            (dirpath / f"chain{i}.yaml").write_text(
+                f"neogram: null\ncolumn:\n  entries:\n{entries}"
+            )
+        # Two columns including each other.
+        for this, other in [("a", "b"), ("b", "a")]:
+            (dirpath / f"cycle_{this}.yaml").write_text(
+                f"neogram: null\ncolumn:\n  entries:\n"
+                f"  - column: {dirpath / f'cycle_{other}.yaml'}\n"
+            )
+
+        def load(i):
+            if i % 4 == 0:
+                try:
+                    retrieve(dirpath / "cycle_a.yaml")
+                except ValueError as error:
+                    assert "cyclical include" in str(error)
+                    return None
+                raise AssertionError("no error for cyclical include")
+            start = i % depth
+            column = retrieve(dirpath / f"chain{start}.yaml")
+            for j in range(start, depth - 1):
+                column = column.entries[1]
+            assert len(column.entries) == 1
+            return start
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(load, range(loads)))
+        assert results.count(None) == loads // 4
+        assert memo.current() == frozenset()
+
+
+def test_watch():
+    "Only the changed file and the files including it are read again."
+    with tempfile.TemporaryDirectory() as dirpath:
+        dirpath = pathlib.Path(dirpath)
+        for name in ["a", "b"]:
+            (dirpath / f"{name}.yaml").write_text(
+                f"neogram: null\nnote:\n  body: Note {name}\n"
+            )
+        (dirpath / "ab.yaml").write_text(
+            f"neogram: null\nrow:\n  entries:\n"
+            f"  - note: {dirpath / 'a.yaml'}\n"
+            f"  - note: {dirpath / 'b.yaml'}\n"
+        )
+        root = dirpath / "root.yaml"
+        root.write_text(
+            f"neogram: null\ncolumn:\n  entries:\n"
+            f"  - row: {dirpath / 'ab.yaml'}\n"
+            f"  - note: {dirpath / 'a.yaml'}\n"
+        )
+        watcher = watch.Watcher(root)
+        watcher.load()
+        assert len(watcher.mtimes) == 4
+        assert not watcher.poll()
+        a = watcher.diagrams[str(dirpath / "a.yaml")]
+        ab = watcher.diagrams[str(dirpath / "ab.yaml")]
+
+        (dirpath / "b.yaml").write_text("neogram: null\nnote:\n  body: Changed\n")
+        os.utime(dirpath / "b.yaml", ns=(0, 0))  # Ensure a different mtime.
+        changed = watcher.poll()
+        assert changed == set([str(dirpath / "b.yaml")])
+        assert watcher.get_affected(changed) == set(
+            [str(dirpath / "b.yaml"), str(dirpath / "ab.yaml"), watcher.location]
+        )
+        watcher.load(changed)
+        assert watcher.diagrams[str(dirpath / "a.yaml")] is a
+        assert watcher.diagrams[str(dirpath / "ab.yaml")] is not ab
+        assert watcher.diagram.entries[0].entries[1].body == "Changed"
+        assert not watcher.poll()
+
+        # Rendered after each change, also of a nested include, using the cache.
+        # A failure when writing is reported, and watching goes on.
+        outputs = []
+        reports = []
+        edits = ["Nested 1", "Nested 2"]
+
+        def write(diagram):
+            outputs.append(diagram.render())
+            if not edits:
+                raise KeyboardInterrupt
+            (dirpath / "b.yaml").write_text(
+                f"neogram: null\nnote:\n  body: {edits.pop(0)}\n"
+            )
+            os.utime(dirpath / "b.yaml", ns=(len(outputs), len(outputs)))
+            if len(outputs) == 2:
+                raise RuntimeError("write failed")
+
+        try:
+            watch.Watcher(root).run(write, interval=0.01, report=reports.append)
+        except KeyboardInterrupt:
+            pass
+        assert len(outputs) == 3
+        assert "Changed" in outputs[0]
+        assert "Nested 1" in outputs[1] and "Changed" not in outputs[1]
+        assert "Nested 2" in outputs[2] and "Nested 1" not in outputs[2]
+        assert "Error: RuntimeError('write failed')" in reports
+
+        # After an unexpected error when first reading, the files are watched.
+        original = watch.retrieve
+
+        def retrieve(location, reuse=None):
+            watch.retrieve = original
+            raise RuntimeError("read failed")
+
+        watch.retrieve = retrieve
+        try:
+            watcher = watch.Watcher(root)
+            try:
+                watcher.load()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("no error when reading")
+        finally:
+            watch.retrieve = original
+        assert not watcher.poll()
+        os.utime(root, ns=(0, 0))
+        changed = watcher.poll()
+        assert changed == set([watcher.location])
+        watcher.load(changed)
+        assert len(watcher.mtimes) == 4
+
+
+def test_modified():
+    "A diagram is built again only when it, or a part of it, has been modified."
+    universe = get_universe()
+    note = Note(body="Unchanged")
+    column = Column(entries=[universe, note, universe])
+    row = Row(entries=[universe, column])
+    first = row.render()
+    generation = universe._generation
+    assert row.render() == first
+    assert universe._generation == generation
+    # The same diagram in several places must not give duplicate ids.
+    ids = re.findall(r'id="([^"]+)"', first)
+    assert ids and len(ids) == len(set(ids))
+
+    note.body = "Changed"
+    assert column._modified and row._modified
+    assert not universe._modified
+    second = row.render()
+    assert "Changed" in second
+    assert universe._generation == generation
+
+    universe += Event("Now", 0)
+    assert column._modified and row._modified
+    row.render()
+    assert universe._generation == generation + 1
+
+    # A top-level container is built again, not served stale from the cache,
+    # when an included diagram of it is modified.
+    with tempfile.TemporaryDirectory() as dirpath:
+        dirpath = pathlib.Path(dirpath)
+        cache.enable(dirpath / "cache")
+        try:
+            (dirpath / "note.yaml").write_text(
+                "neogram: null\nnote:\n  body: Original\n"
+            )
+            (dirpath / "col.yaml").write_text(
+                "neogram: null\ncolumn:\n  entries:\n"
+                f"  - note: {dirpath / 'note.yaml'}\n"
+            )
+            column = retrieve(dirpath / "col.yaml")
+            assert "Original" in column.render()
+            column.entries[0].body = "Changed"
+            svg = column.render()
+            assert "Changed" in svg and "Original" not in svg
+
+            # Also when loaded from a warm cache, its entry never being built.
+            column = retrieve(dirpath / "col.yaml")
+            assert "Original" in column.render()
+            assert column.entries[0]._modified
+            column.entries[0].body = "Changed"
+            svg = column.render()
+            assert "Changed" in svg and "Original" not in svg
+        finally:
+            cache.disable()
+
+
+def test_shared():
+    "The same diagram several times in a container; copies of its elements."
+    universe = get_universe()
+    column = Column(entries=[universe] * 4)
+    svg = column.render()
+    ids = re.findall(r'id="([^"]+)"', svg)
+    assert len(ids) == len(set(ids))
+    held = [list(g)[0] for g in list(column.svg)[-4:]]
+    assert held[0] is universe.svg
+    for elem in held[1:]:
+        assert elem is not universe.svg
+        assert elem.superelement is not None
+        assert len(list(elem.walk())) == len(list(universe.svg.walk()))
+
+    # A copy of an element within a tree is detached from that tree.
+    leaf = next(universe.svg.walk(lambda e: e.tag == "text"))
+    copy = leaf.copy()
+    assert copy == leaf
+    assert copy.superelement is None and leaf.superelement is not None
+    copy["fill"] = "red"
+    assert leaf.get("fill") != "red"
+
+
+def test_cache_key():
+    "Diagrams which are built differently must not have the same cache key."
+    with tempfile.TemporaryDirectory() as dirpath:
+        dirpath = pathlib.Path(dirpath)
+        buildcache = cache.enable(dirpath / "cache")
+        try:
+            diagrams = []
+            for axis in [None, {"absolute": True, "caption": "Cap"}]:
+                diagrams.append(Timelines("T", axis=axis))
+                diagrams[-1] += Period("Then", -10, 10)
+            assert buildcache.get_key(diagrams[0]) != buildcache.get_key(diagrams[1])
+            assert "Cap" not in diagrams[0].render()
+            assert "Cap" in diagrams[1].render()
+            assert buildcache.get_key(Note(body="N")) != buildcache.get_key(
+                Note(body="N", width=500)
+            )
+
+            # The content of an included diagram, not only its location.
+            note = dirpath / "note.yaml"
+            note.write_text("neogram: null\nnote:\n  body: Original\n")
+            (dirpath / "col.yaml").write_text(
+                f"neogram: null\ncolumn:\n  entries:\n  - note: {note}\n"
+            )
+            first = retrieve(dirpath / "col.yaml")
+            assert "Original" in first.render()
+            note.write_text("neogram: null\nnote:\n  body: Changed\n")
+            second = retrieve(dirpath / "col.yaml")
+            assert buildcache.get_key(first) != buildcache.get_key(second)
+            svg = second.render()
+            assert "Changed" in svg and "Original" not in svg
+
+            # The class-level settings; not served the build of another.
+            diagram = Timelines("Shared")
+            diagram += Period("Then", {"value": 0, "error": 1}, 10, fuzzy="gradient")
+            key = buildcache.get_key(diagram)
+            diagram.render()
+            assert not list(diagram.svg.walk(lambda e: e.tag == "defs"))
+            try:
+                Timelines.SHARED_DEFS = False
+                assert buildcache.get_key(diagram) != key
+                diagram.invalidate()
+                diagram.render()
+                assert list(diagram.svg.walk(lambda e: e.tag == "defs"))
+            finally:
+                Timelines.SHARED_DEFS = True
+                diagram.invalidate()
+        finally:
+            cache.disable()
+
+
+def test_cache_size():
+    "The size of the cache is that of its items, also when replacing one."
+    with tempfile.TemporaryDirectory() as dirpath:
+        buildcache = cache.enable(dirpath)
+        try:
+            universe = get_universe()
+            universe.render()
+            for i in range(3):
+                buildcache.store(universe)
+            sizes = [p.stat().st_size for p in buildcache.filepaths()]
+            assert len(sizes) == 1
+            assert buildcache.size == sum(sizes)
+        finally:
+            cache.disable()
+
+
+def test_timelines_numpy(number=1000):
+    "Rendering in bulk using NumPy must give the same result as pure Python."
+    import timelines
+
+    if timelines.numpy is None:
+        return
+    diagram = Timelines("Many entries")
+    fuzzies = [constants.ERROR, constants.WEDGE, constants.GRADIENT]
+    for i in range(number):
+        timeline = f"Timeline {i % 5}"
+        marker = constants.MARKERS[i % len(constants.MARKERS)]
+        placement = constants.PLACEMENTS[i % len(constants.PLACEMENTS)]
+        color = ["red", None, "navy"][i % 3]
+        if i % 3:
+            diagram += Event(
+                f"Event {i}",
+                i * 1.37 - 500,
+                timeline=timeline,
+                marker=marker,
+                placement=placement,
+                color=color,
+            )
+        elif i % 2:
+            diagram += Period(
+                f"Period {i}",
+                i - 500,
+                {"value": i, "error": 10},
+                timeline=timeline,
+                fuzzy=fuzzies[i // 3 % 3],
+                placement=placement,
+                color=color,
+            )
+        else:
+            diagram += Period(
+                f"Period {i}",
+                i - 500,
+                i + 25.5,
+                timeline=timeline,
+                fuzzy=constants.FUZZY_MARKERS[i % 4],
+                placement=placement,
+                color=color,
+            )
+    minimum = Timelines.NUMPY_MIN_ENTRIES
+    results = []
+    try:
+        for Timelines.NUMPY_MIN_ENTRIES in [number + 1, 0]:
+            diagram.invalidate()
+            results.append(diagram.render())
+    finally:
+        Timelines.NUMPY_MIN_ENTRIES = minimum
+    assert results[0] == results[1]
+
+
+def test_aggregate():
+    "Dense events are replaced by density strips; sparse events are kept."
+    diagram = Timelines("Dense", aggregate=5)
+    for i in range(1000):
+        diagram += Event(f"Dense {i}", i / 1000, timeline="Dense")
+    for i in range(10):
+        diagram += Event(f"Sparse {i}", 100 * i, timeline="Sparse")
+    svg = diagram.render()
+    counts = [int(c) for c in re.findall(r"<title>(\d+) events</title>", svg)]
+    assert sum(counts) == 1000
+    assert "Dense 0" not in svg
+    assert "Sparse 9" in svg
+    assert load(diagram.save()) == diagram
+
+    diagram.aggregate = None
+    assert "Dense 0" in diagram.render()
+
+
+def test_labels():
+    "Overlapping labels are hidden, or stacked in extra rows."
+    diagram = Timelines("Labels")
+    for i in range(20):
+        diagram += Event(f"Label {i}", i, timeline="Crowded")
+    diagram += Event("Alone", 10, timeline="Other")
+    svg = diagram.render()
+    height = diagram.height
+    assert all(f"Label {i}<" in svg for i in range(20))
+
+    diagram.labels = constants.HIDE
+    svg = diagram.render()
+    assert diagram.height == height
+    assert "Label 0<" in svg
+    assert "Label 1<" not in svg
+    assert "Alone" in svg
+    assert load(diagram.save()) == diagram
+
+    diagram.labels = constants.STACK
+    svg = diagram.render()
+    assert diagram.height > height
+    assert all(f"Label {i}<" in svg for i in range(20))
+    assert load(diagram.save()) == diagram
+
+    # More labels at the same place than rows; the others are not dropped,
+    # but overlap, and no more rows are added.
+    heights = []
+    for number in [Timelines.MAX_LABEL_ROWS, 3 * Timelines.MAX_LABEL_ROWS]:
+        diagram = Timelines("Crowded", labels=constants.STACK)
+        for i in range(number):
+            diagram += Event(f"Label {i}", 0, timeline="Crowded")
+        diagram += Event("End", 100, timeline="Crowded")
+        svg = diagram.render()
+        assert all(f"Label {i}<" in svg for i in range(number))
+        heights.append(diagram.height)
+    assert heights[0] == heights[1]
+
+
+def test_lanes():
+    "Overlapping periods in a timeline are placed in separate lanes."
+    diagram = Timelines("Lanes")
+    for begin, end in [(0, 10), (5, 15), (12, 20), (16, 25), (1, 2)]:
+        diagram += Period(f"{begin}-{end}", begin, end, timeline="Work")
+    diagram += Event("Event", 3, timeline="Other")
+    diagram.render()
+    height = diagram.height
+    assert diagram.get_lanes() == [0, 1, 0, 1, 1, 0]
+
+    diagram.lanes = True
+    svg = diagram.render()
+    assert diagram.height == height + constants.DEFAULT_SIZE + constants.DEFAULT_PADDING
+    assert len(set(re.findall(r'<rect x="[^"]+" y="([^"]+)"', svg))) == 2
+    assert load(diagram.save()) == diagram
+
+
+def test_markers():
+    "Markers drawn as paths are defined once, and referred to by 'use'."
+    diagram = Timelines("Markers")
+    for i in range(100):
+        diagram += Event(f"Star {i}", i, timeline="Stars", marker=constants.STAR)
+    svg = diagram.render()
+    assert svg.count("<use ") == 100
+    assert len(re.findall(r'<path id="', svg)) == 1
+
+    # All copies of the diagram refer to the same definition.
+    svg = Column(entries=[diagram, diagram]).render()
+    ids = re.findall(r' id="([^"]+)"', svg)
+    assert len(ids) == 1
+    assert set(re.findall(r'href="#([^"]+)"', svg)) == set(ids)
+
+
+def test_gradients():
+    "Gradients are defined once in the document, with the same ids in each run."
+    diagrams = []
+    for title in ["First", "Second"]:
+        diagram = Timelines(title)
+        for i in range(50):
+            diagram += Period(
+                f"Period {i}",
+                {"value": i, "error": 0.5},
+                {"value": i + 2, "error": 0.5},
+                timeline=title,
+                color="orange",
+                fuzzy=constants.GRADIENT,
+            )
+        diagrams.append(diagram)
+    svg = Column(entries=diagrams).render()
+    assert svg.count("<defs>") == 1
+    ids = re.findall(r'<linearGradient id="([^"]+)"', svg)
+    assert len(ids) == len(set(ids)) == 4
+    assert set(re.findall(r"url\(#([^)]+)\)", svg)) == set(ids)
+
+    # Defined within each period, when not shared; still no duplicate ids.
+    try:
+        Timelines.SHARED_DEFS = False
+        for diagram in diagrams:
+            diagram.invalidate()
+        local = Column(entries=diagrams).render()
+    finally:
+        Timelines.SHARED_DEFS = True
+        for diagram in diagrams:
+            diagram.invalidate()
+    ids = re.findall(r'<linearGradient id="([^"]+)"', local)
+    assert len(ids) == len(set(ids)) == 100 * 4
+    assert set(re.findall(r"url\(#([^)]+)\)", local)) == set(ids)
+
+    # Same output when built from the cache, and when built again.
+    with tempfile.TemporaryDirectory() as dirpath:
+        cache.enable(dirpath)
+        try:
+            diagrams[0].invalidate()
+            assert Column(entries=diagrams).render() == svg
+            diagrams[0].invalidate()
+            assert Column(entries=diagrams).render() == svg
+        finally:
+            cache.disable()
+
+
+def test_defs_cached():
+    "A container from a warm cache has the definitions of its unbuilt entries."
+    with tempfile.TemporaryDirectory() as dirpath:
+        dirpath = pathlib.Path(dirpath)
+        cache.enable(dirpath / "cache")
+        try:
+            stars = dirpath / "stars.yaml"
+            diagram = Timelines("Stars")
+            for i in range(10):
+                diagram += Event(f"Star {i}", i, marker=constants.STAR)
+            diagram.save(stars)
+            note = dirpath / "note.yaml"
+            note.write_text("neogram: null\nnote:\n  body: N\n")
+            for kind, entries in [
+                ("column", f"  - timelines: {stars}\n  - note: {note}\n"),
+                (
+                    "board",
+                    f"  - {{x: 0, y: 0, timelines: {stars}}}\n"
+                    f"  - {{x: 0, y: 200, note: {note}}}\n",
+                ),
+            ]:
+                infilepath = dirpath / f"{kind}.yaml"
+                infilepath.write_text(f"neogram: null\n{kind}:\n  entries:\n{entries}")
+                first = retrieve(infilepath).render()
+                # Freshly parsed entries, not built, since the container is cached.
+                diagram = retrieve(infilepath)
+                second = diagram.render()
+                assert not hasattr(diagram.get_subdiagrams()[1], "svg")
+                assert second.count("<defs>") == 1
+                ids = re.findall(r' id="([^"]+)"', second)
+                assert len(ids) == 1
+                assert set(re.findall(r'href="#([^"]+)"', second)) == set(ids)
+                assert second == first
+        finally:
+            cache.disable()
+
+
+def test_cairo():
+    """Drawing directly with cairo gives nearly the same images as via cairosvg.
+    Also for a diagram of each marker, labels and gradients on its own.
+    """
+    # Imported only here, since cairosvg is slow to import.
+    import cairosvg
+    import PIL.Image
+    import PIL.ImageChops
+    import cairorender
+
+    diagrams = {}
+    for name in ["universe_earth", "pyramid", "notes", "cpies", "poster"]:
+        diagrams[name] = retrieve(f"{name}.yaml")
+    for marker in constants.MARKERS:
+        diagram = Timelines(marker)
+        for i in range(5):
+            diagram += Event(f"Label {i}", 10 * i, timeline=marker, marker=marker)
+        diagrams[marker] = diagram
+    diagram = Timelines("gradients")
+    for i in range(5):
+        diagram += Period(
+            f"Period {i}",
+            {"value": 10 * i, "error": 3},
+            {"value": 10 * i + 20, "error": 3},
+            timeline=str(i),
+            fuzzy=constants.GRADIENT,
+        )
+    diagrams["gradients"] = diagram
+
+    svgs = [diagram.render() for diagram in diagrams.values()]
+    for feature in ["<text", "<use", "<linearGradient"]:
+        assert any(feature in svg for svg in svgs), feature
+    for name, diagram in diagrams.items():
+        direct = PIL.Image.open(io.BytesIO(cairorender.get_png(diagram)))
+        svg = cairosvg.svg2png(bytestring=diagram.render().encode("utf-8"))
+        via = PIL.Image.open(io.BytesIO(svg)).convert("RGBA")
+        assert direct.size == via.size
+        difference = PIL.ImageChops.difference(direct.convert("RGBA"), via)
+        differing = sum([1 for pixel in difference.getdata() if max(pixel) > 64])
+        # Relative to the pixels drawn, so that small diagrams count.
+        drawn = sum([1 for pixel in via.getdata() if pixel[3]])
+        assert differing < 0.01 * drawn, name
+        assert cairorender.get_pdf(diagram).startswith(b"%PDF")
+
+
+def test_pdf():
+    "Many diagrams as pages of one PDF; the entries of a column split into pages."
+    import cairorender
+    import neogram2pdf
+
+    infilepaths = ["universe.yaml", "earth.yaml", "universe_earth.yaml"]
+    with tempfile.TemporaryDirectory() as dirpath:
+        outfilepath = pathlib.Path(dirpath) / "pages.pdf"
+        pages = cairorender.write_pdf(neogram2pdf.get_pages(infilepaths), outfilepath)
+        assert pages == 3
+        data = outfilepath.read_bytes()
+        assert len(re.findall(rb"/Type\s*/Page\b", data)) == 3
+        pages = neogram2pdf.get_pages(infilepaths, split=True)
+        assert cairorender.write_pdf(pages, outfilepath) == 4
+
+        # No truncated PDF is left when a page fails.
+        outfilepath.unlink()
+        badfilepath = pathlib.Path(dirpath) / "bad.yaml"
+        badfilepath.write_text("neogram: null\nnote:\n  body: 3\n")
+        pages = neogram2pdf.get_pages(infilepaths + [badfilepath])
+        try:
+            cairorender.write_pdf(pages, outfilepath)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("no error for bad page")
+        assert not outfilepath.exists()
+
+
+def test_tiles():
+    """Tiles of a board, as a pyramid of two zoom levels, rendered by two workers.
+    Each tile, including those at the edges, is that part of a full rendering.
+    """
+    import cairosvg
+    import PIL.Image
+    import PIL.ImageChops
+    import cairorender
+    import tiles
+
+    diagram = retrieve("poster.yaml")
+    for direct in [False, True]:
+        with tempfile.TemporaryDirectory() as dirpath:
+            count = tiles.write_tiles(
+                diagram, dirpath, scale=2, size=256, zoom=1, workers=2, direct=direct
+            )
+            # 651 x 464.6 at scale 1 and 2: 3 x 2 plus 6 x 4 tiles.
+            assert count == 30
+            filepaths = list(pathlib.Path(dirpath).rglob("*.png"))
+            assert len(filepaths) == count
+            for level, scale, columns, rows in [(0, 1, 3, 2), (1, 2, 6, 4)]:
+                if direct:
+                    data = cairorender.get_png(diagram, scale=scale)
+                else:
+                    svg = diagram.render().encode("utf-8")
+                    data = cairosvg.svg2png(bytestring=svg, scale=scale)
+                full = PIL.Image.open(io.BytesIO(data)).convert("RGBA")
+                for column in range(columns):
+                    for row in range(rows):
+                        filepath = pathlib.Path(dirpath, str(level), str(column))
+                        tile = PIL.Image.open(filepath / f"{row}.png")
+                        assert tile.size == (256, 256)
+                        tile = tile.convert("RGBA")
+                        # Cropping beyond the full rendering gives transparency.
+                        x, y = column * 256, row * 256
+                        part = full.crop((x, y, x + 256, y + 256))
+                        difference = PIL.ImageChops.difference(tile, part)
+                        # Allow for a few antialiased pixels at the borders.
+                        pixels = sum(1 for p in difference.getdata() if max(p) > 32)
+                        assert pixels < 16, (level, column, row, pixels)
+                # The right and bottom edge tiles extend beyond the diagram.
+                filepath = pathlib.Path(dirpath, str(level), str(columns - 1))
+                tile = PIL.Image.open(filepath / f"{rows - 1}.png").convert("RGBA")
+                assert tile.getpixel((255, 255))[3] == 0
+
+
+def test_scales():
+    """Several scales from one build; in sequence, in parallel, and drawn directly.
+    Each is the same image as when rendering the diagram at only that scale.
+    """
+    import cairosvg
+    import PIL.Image
+    import PIL.ImageChops
+    import cairorender
+    import neogram2png
+
+    infilepath = pathlib.Path("universe.yaml")
+    diagram = retrieve(infilepath)
+    svg = diagram.render().encode("utf-8")
+    with tempfile.TemporaryDirectory() as dirpath:
+        template = str(pathlib.Path(dirpath) / "{stem}@{scale}x.png")
+        outfilepaths = neogram2png.get_outfilepaths(infilepath, [1, 2, 3], template)
+        assert outfilepaths[2] == pathlib.Path(dirpath) / "universe@2x.png"
+        for direct, workers in [(False, 1), (False, 3), (True, 1), (True, 2)]:
+            neogram2png.write_pngs(
+                diagram, outfilepaths, direct=direct, workers=workers
+            )
+            for scale, outfilepath in outfilepaths.items():
+                if direct:
+                    data = cairorender.get_png(diagram, scale=scale)
+                else:
+                    data = cairosvg.svg2png(bytestring=svg, scale=scale)
+                expected = PIL.Image.open(io.BytesIO(data)).convert("RGBA")
+                image = PIL.Image.open(outfilepath).convert("RGBA")
+                assert image.size == expected.size
+                difference = PIL.ImageChops.difference(image, expected)
+                assert difference.getbbox() is None, (direct, workers, scale)
+            for outfilepath in outfilepaths.values():
+                outfilepath.unlink()
+    try:
+        neogram2png.get_outfilepaths(infilepath, [1, 2], "universe.png")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("no error for template without scale")
+
+
+def test_encode():
+    "Re-encoding a PNG of flat colors as palette PNG, stripped, and WebP."
+    import PIL.Image
+    import PIL.ImageDraw
+    import PIL.PngImagePlugin
+    import neogram2png
+
+    image = PIL.Image.new("RGBA", (400, 300), (0, 0, 0, 0))
+    draw = PIL.ImageDraw.Draw(image)
+    for i, color in enumerate(constants.DEFAULT_PALETTE):
+        draw.ellipse((i * 30, 40, i * 30 + 60, 260), fill=color, outline="black")
+        draw.text((i * 30, 10), "Label", fill="black")
+    info = PIL.PngImagePlugin.PngInfo()
+    info.add_text("Software", "Neogram")
+    outfile = io.BytesIO()
+    image.save(outfile, format="png", pnginfo=info)
+    data = outfile.getvalue()
+
+    quantized = neogram2png.encode(data, colors=64, compression=9)
+    assert len(quantized) < len(data)
+    quantized = PIL.Image.open(io.BytesIO(quantized))
+    assert quantized.mode == "P"
+    assert quantized.size == image.size
+    assert quantized.text == {"Software": "Neogram"}
+    quantized = quantized.convert("RGBA")
+    assert quantized.getpixel((399, 299))[3] == 0  # Still transparent.
+    for xy in [(10, 150), (190, 150)]:  # Inside the first and last ellipses.
+        assert quantized.getpixel(xy) == image.getpixel(xy)
+
+    stripped = PIL.Image.open(io.BytesIO(neogram2png.encode(data, strip=True)))
+    assert stripped.text == {}
+
+    webp = neogram2png.encode(data, format="webp")
+    assert len(webp) < len(data)
+    webp = PIL.Image.open(io.BytesIO(webp))
+    assert webp.format == "WEBP"
+    webp = webp.convert("RGBA")
+    assert webp.getpixel((399, 299))[3] == 0
+    for xy in [(10, 150), (190, 150)]:
+        assert webp.getpixel(xy) == image.getpixel(xy)
+
+
+def test_png_options():
+    "Quantized, compressed, stripped and WebP output is smaller than the default."
+    import PIL.Image
+    import neogram2png
+
+    diagram = retrieve("universe.yaml")
+    data = neogram2png.get_png(diagram)
+    image = PIL.Image.open(io.BytesIO(data))
+    encoding = dict(colors=64, compression=9, strip=True)
+    quantized = neogram2png.get_png(diagram, encoding=encoding)
+    assert len(quantized) < len(data)
+    quantized = PIL.Image.open(io.BytesIO(quantized))
+    assert quantized.format == "PNG"
+    assert quantized.mode == "P"
+    assert quantized.size == image.size
+    webp = neogram2png.get_png(diagram, encoding=dict(format="webp"))
+    assert len(webp) < len(data)
+    webp = PIL.Image.open(io.BytesIO(webp))
+    assert webp.format == "WEBP"
+    assert webp.size == image.size
+
+
 def run_tests():
     origdir = os.getcwd()
     try:
@@ -293,6 +1194,28 @@ def run_tests():
         test_declaration()
         test_notes()
         test_poster()
+        test_render_targets()
+        test_remote()
+        test_serve()
+        test_concurrent_includes()
+        test_watch()
+        test_modified()
+        test_shared()
+        test_cache_key()
+        test_cache_size()
+        test_timelines_numpy()
+        test_aggregate()
+        test_labels()
+        test_lanes()
+        test_markers()
+        test_gradients()
+        test_defs_cached()
+        test_cairo()
+        test_pdf()
+        test_tiles()
+        test_scales()
+        test_encode()
+        test_png_options()
     finally:
         os.chdir(origdir)
 
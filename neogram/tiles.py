@@ -0,0 +1,127 @@
+"""Render a diagram as fixed-size PNG tiles, for huge boards and posters.
+Optionally a pyramid of zoom levels, laid out as 'level/column/row.png',
+as expected by web map viewers. The tiles are rasterized in parallel
+worker processes, each one only ever allocating the bitmap for one tile.
+"""
+
+import concurrent.futures
+import io
+import math
+import os
+import pathlib
+
+import utils
+
+DEFAULT_SIZE = 256
+
+# State of the worker process; the document to render tiles from.
+_worker = {}
+
+
+def get_levels(width, height, scale=1.0, size=DEFAULT_SIZE, zoom=0):
+    """Return a list of tuples (level, scale, columns, rows) for the zoom levels
+    of the pyramid, for the document of the given width and height.
+    The highest level has the given scale, and each level below it half that.
+    """
+    result = []
+    for level in range(zoom + 1):
+        level_scale = scale / 2 ** (zoom - level)
+        columns = max(1, math.ceil(width * level_scale / size))
+        rows = max(1, math.ceil(height * level_scale / size))
+        result.append((level, level_scale, columns, rows))
+    return result
+
+
+def init_worker(document, direct):
+    """Set up the worker process for rendering tiles of the document.
+    For cairosvg, the SVG text after the root starting tag is produced once;
+    only the root starting tag, with the viewBox of the tile, differs.
+    """
+    _worker["document"] = document
+    _worker["direct"] = direct
+    if direct:
+        import cairorender
+
+        _worker["renderer"] = cairorender.Renderer(None, document)
+    else:
+        outfile = io.StringIO()
+        document.write(outfile)
+        _worker["tail"] = outfile.getvalue()[len(str(document)) :]
+
+
+def render_tile(outfilepath, x, y, scale, size):
+    """Render the tile having its upper left corner at the given position,
+    in user units, at the given scale, and write it as PNG to the file.
+    """
+    document = _worker["document"]
+    if _worker["direct"]:
+        import cairocffi
+
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, size, size)
+        context = cairocffi.Context(surface)
+        context.scale(scale, scale)
+        context.translate(-x, -y)
+        renderer = _worker["renderer"]
+        renderer.context = context
+        renderer.font = None
+        renderer.draw(document)
+        surface.write_to_png(str(outfilepath))
+    else:
+        import cairosvg
+
+        extent = utils.N(size / scale)
+        document["width"] = extent
+        document["height"] = extent
+        document["viewBox"] = f"{utils.N(x)} {utils.N(y)} {extent} {extent}"
+        cairosvg.svg2png(
+            bytestring=(str(document) + _worker["tail"]).encode("utf-8"),
+            write_to=str(outfilepath),
+            output_width=size,
+            output_height=size,
+        )
+    return outfilepath
+
+
+def write_tiles(
+    diagram,
+    outdirpath,
+    scale=1.0,
+    size=DEFAULT_SIZE,
+    zoom=0,
+    workers=None,
+    direct=False,
+):
+    """Render the diagram as tiles of the given size in pixels, written as
+    'level/column/row.png' in the directory, for each level of the pyramid.
+    Tiles at the right and bottom edges extend beyond the diagram; that part
+    is transparent. Return the number of tiles written.
+    """
+    document = diagram.get_document()
+    width, height = float(document["width"]), float(document["height"])
+    outdirpath = pathlib.Path(outdirpath)
+    tiles = []
+    for level, level_scale, columns, rows in get_levels(
+        width, height, scale=scale, size=size, zoom=zoom
+    ):
+        for column in range(columns):
+            dirpath = outdirpath / str(level) / str(column)
+            dirpath.mkdir(parents=True, exist_ok=True)
+            for row in range(rows):
+                tiles.append(
+                    (
+                        dirpath / f"{row}.png",
+                        column * size / level_scale,
+                        row * size / level_scale,
+                        level_scale,
+                        size,
+                    )
+                )
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        initializer=init_worker,
+        initargs=(document, direct),
+    ) as executor:
+        futures = [executor.submit(render_tile, *tile) for tile in tiles]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    return len(tiles)
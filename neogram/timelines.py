@@ -2,6 +2,9 @@
 
 __all__ = ["Timelines", "Event", "Period"]
 
+import heapq
+import math
+
 import constants
 from color import *
 from diagram import *
@@ -9,12 +12,32 @@ from dimension import *
 from path import *
 import utils
 
+try:
+    import numpy
+except ImportError:  # Optional; used for rendering very many entries faster.
+    numpy = None
+
 
 class Timelines(Diagram):
     "Timelines having events and periods."
 
     DEFAULT_WIDTH = 600
 
+    # Minimum number of entries for rendering in bulk using NumPy, if available.
+    NUMPY_MIN_ENTRIES = 500
+
+    # Define markers drawn as paths and gradients once in the document,
+    # and refer to them by id; else in full for each entry.
+    SHARED_DEFS = True
+
+    # Density strips for aggregated events: color and number of opacity levels.
+    AGGREGATE_COLOR = "black"
+    AGGREGATE_LEVELS = 10
+
+    # Maximum number of rows of labels in a timeline, when stacking labels.
+    MAX_LABEL_ROWS = 4
+    LABEL_ROW_HEIGHT = Diagram.DEFAULT_FONT_SIZE + constants.DEFAULT_PADDING
+
     SCHEMA = {
         "title": __doc__,
         "$anchor": "timelines",
@@ -37,6 +60,25 @@ class Timelines(Diagram):
                 "type": "boolean",
                 "default": True,
             },
+            "aggregate": {
+                "title": "Show the events as a density strip where at least"
+                " this many of them fall within the same pixel of a timeline.",
+                "type": "integer",
+                "minimum": 2,
+            },
+            "lanes": {
+                "title": "Place overlapping periods in separate lanes"
+                " within their timeline.",
+                "type": "boolean",
+                "default": False,
+            },
+            "labels": {
+                "title": "Handling of overlapping labels in a timeline:"
+                " allow overlaps, hide labels, or stack labels in extra rows."
+                " Labels beyond the maximum number of rows overlap the others.",
+                "enum": constants.LABEL_LAYOUTS,
+                "default": constants.OVERLAP,
+            },
             "axis": {
                 "title": "Time axis specification.",
                 "oneOf": [
@@ -209,15 +251,206 @@ class Timelines(Diagram):
         width=None,
         legend=None,
         axis=None,
+        aggregate=None,
+        labels=None,
+        lanes=None,
     ):
         super().__init__(title=title, entries=entries)
         assert width is None or (isinstance(width, (int, float)) and width > 0)
         assert legend is None or isinstance(legend, bool)
         assert axis is None or isinstance(axis, (bool, dict))
+        assert aggregate is None or (isinstance(aggregate, int) and aggregate >= 2)
+        assert labels is None or labels in constants.LABEL_LAYOUTS
+        assert lanes is None or isinstance(lanes, bool)
 
         self.width = width or self.DEFAULT_WIDTH
         self.legend = True if legend is None else legend
         self.axis = True if axis is None else axis
+        self.aggregate = aggregate
+        self.labels = labels or constants.OVERLAP
+        self.lanes = bool(lanes)
+
+    def render_entries(self, timelines, dimension, offsets=None, defs=None):
+        """Return the list of graphics, and the list of labels (or None)
+        for each entry. If NumPy is available and there are many entries,
+        then simple events and periods are rendered in bulk. The result
+        is the same. Dense events are replaced by density strips,
+        if 'aggregate' is set. The entries are placed at the given
+        vertical offsets from their timelines, if any; for lanes.
+        Markers drawn as paths and gradients are referred to by id in the
+        given dictionary of definitions, if any.
+        """
+        if self.aggregate:
+            entries, strips = self.aggregate_events(timelines, dimension)
+        else:
+            entries = self.entries
+            strips = []
+        groups = {}  # Key: vertical offset; value: indexes of entries.
+        if offsets:
+            offsets = dict(zip([id(e) for e in self.entries], offsets))
+            for i, entry in enumerate(entries):
+                groups.setdefault(offsets[id(entry)], []).append(i)
+        else:
+            groups[0] = range(len(entries))
+        graphics = [None] * len(entries)
+        labels = [None] * len(entries)
+        for offset, indexes in groups.items():
+            group = [entries[i] for i in indexes]
+            if offset:
+                group_timelines = {t: y + offset for t, y in timelines.items()}
+            else:
+                group_timelines = timelines
+            if numpy is None or len(group) < self.NUMPY_MIN_ENTRIES:
+                group_graphics = [
+                    e.render_graphic(group_timelines, dimension, defs) for e in group
+                ]
+                group_labels = [
+                    e.render_label(group_timelines, dimension) for e in group
+                ]
+            else:
+                group_graphics, group_labels = render_entries_numpy(
+                    group, group_timelines, dimension, defs
+                )
+            for i, graphic, label in zip(indexes, group_graphics, group_labels):
+                graphics[i] = graphic
+                labels[i] = label
+        if len(entries) < len(self.entries):  # No labels for aggregated events.
+            labels = dict(zip([id(e) for e in entries], labels))
+            labels = [labels.get(id(e)) for e in self.entries]
+        return strips + graphics, labels
+
+    def get_lanes(self):
+        """Return the lane for each entry, such that periods overlapping in time
+        within a timeline are in different lanes. Events are in lane 0.
+        The periods are sorted by their beginning, and each is placed in the
+        lane which became free the earliest, if any; a heap of the ends of
+        the lanes. This uses the fewest number of lanes possible.
+        """
+        lanes = [0] * len(self.entries)
+        periods = {}  # Key: timeline; value: list of (begin, end, index).
+        for i, entry in enumerate(self.entries):
+            if isinstance(entry, Period):
+                periods.setdefault(entry.timeline, []).append((*entry.minmax, i))
+        for items in periods.values():
+            items.sort()
+            ends = []  # Heap of (end, lane) for the last period in each lane.
+            for begin, end, i in items:
+                if ends and ends[0][0] <= begin:
+                    lanes[i] = ends[0][1]
+                    heapq.heapreplace(ends, (end, lanes[i]))
+                else:
+                    lanes[i] = len(ends)
+                    heapq.heappush(ends, (end, lanes[i]))
+        return lanes
+
+    def layout_labels(self, labels, lanes):
+        """Arrange the labels, given for each entry, to avoid overlaps.
+        The extents of the labels in each lane of a timeline are sorted and swept
+        in order. Either hide those overlapping an already placed label,
+        keeping as many as possible, or stack them in extra rows. When all
+        rows are taken, a label is left in place in the first row, overlapping.
+        Return the row for each label, or None if it is not to be shown.
+        """
+        extents = {}  # Key: timeline; value: list of (left, right, index).
+        for i, (entry, label) in enumerate(zip(self.entries, labels)):
+            if label is None:
+                continue
+            width = utils.get_text_length(
+                entry.label,
+                font=constants.DEFAULT_FONT_FAMILY,
+                size=self.DEFAULT_FONT_SIZE,
+            )
+            left = float(label["x"])
+            match label.get("text-anchor"):
+                case "end":
+                    left -= width
+                case "start":
+                    pass
+                case _:
+                    left -= width / 2
+            extents.setdefault((entry.timeline, lanes[i]), []).append(
+                (left, left + width, i)
+            )
+
+        rows = [None] * len(labels)
+        for items in extents.values():
+            if self.labels == constants.HIDE:
+                # In order of right end; keeps the largest number of labels.
+                items.sort(key=lambda item: item[1])
+                end = -math.inf
+                for left, right, i in items:
+                    if left >= end + constants.DEFAULT_PADDING:
+                        rows[i] = 0
+                        end = right
+            else:
+                # In order of left end; into the first row having room.
+                items.sort()
+                ends = []  # Right end of the last label in each row.
+                for left, right, i in items:
+                    for row, end in enumerate(ends):
+                        if left >= end + constants.DEFAULT_PADDING:
+                            rows[i] = row
+                            ends[row] = right
+                            break
+                    else:
+                        if len(ends) < self.MAX_LABEL_ROWS:
+                            rows[i] = len(ends)
+                            ends.append(right)
+                        else:  # As if overlapping labels were allowed.
+                            rows[i] = 0
+        return rows
+
+    def aggregate_events(self, timelines, dimension):
+        """Bin the events of each timeline by pixel. The events in each bin
+        having at least 'aggregate' events are replaced by a density strip,
+        with opacity according to the number of events.
+        Adjacent bins of the same opacity are merged into one strip.
+        Return the list of the remaining entries and the list of strips.
+        """
+        bins = {}  # Key: (timeline, pixel); value: list of events.
+        for entry in self.entries:
+            if isinstance(entry, Event):
+                if isinstance(entry.instant, dict):
+                    instant = entry.instant["value"]
+                else:
+                    instant = entry.instant
+                pixel = math.floor(dimension.get_pixel(instant))
+                bins.setdefault((entry.timeline, pixel), []).append(entry)
+        counts = {}  # Key: timeline; value: dict with key pixel, value count.
+        aggregated = set()  # Identities of the events replaced by strips.
+        for (timeline, pixel), events in bins.items():
+            if len(events) >= self.aggregate:
+                counts.setdefault(timeline, {})[pixel] = len(events)
+                aggregated.update([id(e) for e in events])
+        if not aggregated:
+            return self.entries, []
+
+        maximum = max([max(c.values()) for c in counts.values()])
+        strips = []
+        for timeline, height in timelines.items():
+            runs = []  # List of [first pixel, last pixel, level, count].
+            for pixel, count in sorted(counts.get(timeline, {}).items()):
+                level = math.ceil(self.AGGREGATE_LEVELS * count / maximum)
+                if runs and runs[-1][1] == pixel - 1 and runs[-1][2] == level:
+                    runs[-1][1] = pixel
+                    runs[-1][3] += count
+                else:
+                    runs.append([pixel, pixel, level, count])
+            for first, last, level, count in runs:
+                strip = Element(
+                    "rect",
+                    Element("title", f"{count} events"),
+                    x=utils.N(first),
+                    y=utils.N(height),
+                    width=utils.N(last - first + 1),
+                    height=constants.DEFAULT_SIZE,
+                    stroke="none",
+                    fill=self.AGGREGATE_COLOR,
+                )
+                strip["fill-opacity"] = utils.N(level / self.AGGREGATE_LEVELS)
+                strips.append(strip)
+        entries = [e for e in self.entries if id(e) not in aggregated]
+        return entries, strips
 
     def check_entry(self, entry):
         if not isinstance(entry, (Event, Period)):
@@ -231,6 +464,14 @@ class Timelines(Diagram):
             result["width"] = self.width
         if self.legend is not None and not self.legend:
             result["legend"] = False
+        if self.axis is not True:
+            result["axis"] = self.axis
+        if self.aggregate:
+            result["aggregate"] = self.aggregate
+        if self.labels != constants.OVERLAP:
+            result["labels"] = self.labels
+        if self.lanes:
+            result["lanes"] = True
         return result
 
     def build(self):
@@ -245,6 +486,16 @@ class Timelines(Diagram):
         dimension = Dimension(width=self.width)
         timelines = dict()  # Key: timeline; value: height
 
+        # Overlapping periods in separate lanes, if required.
+        lane_height = constants.DEFAULT_SIZE + constants.DEFAULT_PADDING
+        if self.lanes:
+            lanes = self.get_lanes()
+        else:
+            lanes = [0] * len(self.entries)
+        nlanes = {}  # Key: timeline; value: number of lanes.
+        for entry, lane in zip(self.entries, lanes):
+            nlanes[entry.timeline] = max(nlanes.get(entry.timeline, 1), lane + 1)
+
         # Set the heights for each timeline, and the offset for legends.
         area_height = self.height
         kwargs = dict(
@@ -253,26 +504,72 @@ class Timelines(Diagram):
         )
 
         for entry in self.entries:
-            if self.legend:
-                dimension.update_offset(utils.get_text_length(entry.timeline, **kwargs))
             dimension.update_span(entry.minmax)
             if entry.timeline not in timelines:
+                if self.legend:  # Measure each timeline legend only once.
+                    dimension.update_offset(
+                        utils.get_text_length(entry.timeline, **kwargs)
+                    )
                 self.height += constants.DEFAULT_PADDING
                 timelines[entry.timeline] = self.height
-                self.height += constants.DEFAULT_SIZE + constants.DEFAULT_PADDING
+                self.height += nlanes[entry.timeline] * lane_height
+
+        # The ticks of the time axis also set the scale for the entries.
+        if isinstance(self.axis, dict):
+            absolute = bool(self.axis.get("absolute"))
+            color = self.axis.get("color") or "gray"
+            caption = self.axis.get("caption")
+        else:
+            absolute = False
+            color = "gray"
+            caption = None
+        ticks = dimension.get_ticks(absolute=absolute)
+
+        # Graphics and labels for entries; labels arranged if required.
+        defs = self.defs if self.SHARED_DEFS else None
+        if self.lanes:
+            offsets = [lane * lane_height for lane in lanes]
+        else:
+            offsets = None
+        entry_graphics, entry_labels = self.render_entries(
+            timelines, dimension, offsets, defs
+        )
+        if self.labels != constants.OVERLAP:
+            rows = self.layout_labels(entry_labels, lanes)
+            # Extra rows of labels increase the height of each lane.
+            extra = {}  # Key: timeline; value: additional height of each lane.
+            for entry, row in zip(self.entries, rows):
+                if row:
+                    extra[entry.timeline] = max(
+                        extra.get(entry.timeline, 0), row * self.LABEL_ROW_HEIGHT
+                    )
+            if extra:
+                shift = 0
+                for timeline in timelines:
+                    timelines[timeline] += shift
+                    shift += nlanes[timeline] * extra.get(timeline, 0)
+                self.height += shift
+                if self.lanes:
+                    offsets = [
+                        lane * (lane_height + extra.get(entry.timeline, 0))
+                        for entry, lane in zip(self.entries, lanes)
+                    ]
+                # Again, since the vertical positions have changed.
+                entry_graphics, entry_labels = self.render_entries(
+                    timelines, dimension, offsets, defs
+                )
+            for label, row in zip(entry_labels, rows):
+                if row:
+                    label["y"] = utils.N(
+                        float(label["y"]) + row * self.LABEL_ROW_HEIGHT
+                    )
+            entry_labels = [
+                None if row is None else label for label, row in zip(entry_labels, rows)
+            ]
 
         # Time axis lines and their labels.
         if self.axis:
-            if isinstance(self.axis, dict):
-                absolute = bool(self.axis.get("absolute"))
-                color = self.axis.get("color") or "gray"
-                caption = self.axis.get("caption")
-            else:
-                absolute = False
-                color = "gray"
-                caption = None
             self.svg += (axis := Element("g"))
-            ticks = dimension.get_ticks(absolute=absolute)
             path = Path(ticks[0].pixel, area_height).V(self.height)
             for tick in ticks[1:]:
                 path.M(tick.pixel, area_height).V(self.height)
@@ -314,16 +611,16 @@ class Timelines(Diagram):
 
         # Graphics for entries.
         self.svg += (graphics := Element("g"))
-        for entry in self.entries:
-            graphics += entry.render_graphic(timelines, dimension)
+        for graphic in entry_graphics:
+            graphics += graphic
 
         # Entry labels after graphics, to render on top.
         self.svg += (labels := Element("g"))
         labels["text-anchor"] = "middle"
         labels["stroke"] = "none"
         labels["fill"] = "black"
-        for entry in self.entries:
-            if label := entry.render_label(timelines, dimension):
+        for label in entry_labels:
+            if label:
                 labels += label
 
         # Legend labels.
@@ -371,7 +668,7 @@ class _Entry(Entity):
     def minmax(self):
         raise NotImplementedError
 
-    def render_graphic(self, timelines, dimension):
+    def render_graphic(self, timelines, dimension, defs=None):
         raise NotImplementedError
 
     def render_label(self, timelines, dimension):
@@ -455,149 +752,47 @@ class Event(_Entry):
         else:
             return self.instant
 
-    def render_graphic(self, timelines, dimension):
+    def render_graphic(self, timelines, dimension, defs=None):
+        """Return the graphic for the marker. If a dictionary of definitions
+        is given, then a marker drawn as a path refers to its definition.
+        """
         if isinstance(self.instant, dict):
             x = dimension.get_pixel(self.instant["value"])
         else:
             x = dimension.get_pixel(self.instant)
         color = self.color or "black"
-
-        match self.marker:
-
-            case constants.DISC:
-                elem = Element(
-                    "circle",
-                    cx=utils.N(x),
-                    cy=utils.N(timelines[self.timeline] + constants.DEFAULT_SIZE / 2),
-                    r=constants.DEFAULT_SIZE / 2,
-                    fill=color,
-                    stroke="none",
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.CIRCLE:
-                elem = Element(
-                    "circle",
-                    cx=utils.N(x),
-                    cy=utils.N(timelines[self.timeline] + constants.DEFAULT_SIZE / 2),
-                    r=constants.DEFAULT_SIZE / 2,
-                    fill="none",
-                    stroke=color,
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.OVAL:
-                elem = Element(
-                    "ellipse",
-                    cx=utils.N(x),
-                    cy=utils.N(timelines[self.timeline] + constants.DEFAULT_SIZE / 2),
-                    rx=constants.DEFAULT_SIZE / 5,
-                    ry=constants.DEFAULT_SIZE / 2,
-                    fill=color,
-                    stroke="none",
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 5
-
-            case constants.ELLIPSE:
-                elem = Element(
-                    "ellipse",
-                    cx=utils.N(x),
-                    cy=utils.N(timelines[self.timeline] + constants.DEFAULT_SIZE / 2),
-                    rx=constants.DEFAULT_SIZE / 5,
-                    ry=constants.DEFAULT_SIZE / 2,
-                    fill="none",
-                    stroke=color,
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 5
-
-            case constants.BLOCK:
-                elem = Element(
-                    "rect",
-                    x=utils.N(x - constants.DEFAULT_SIZE / 2),
-                    y=utils.N(timelines[self.timeline]),
-                    width=utils.N(constants.DEFAULT_SIZE),
-                    height=utils.N(constants.DEFAULT_SIZE),
-                    fill=color,
-                    stroke="none",
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.SQUARE:
-                elem = Element(
-                    "rect",
-                    x=utils.N(x - constants.DEFAULT_SIZE / 2),
-                    y=utils.N(timelines[self.timeline]),
-                    width=utils.N(constants.DEFAULT_SIZE),
-                    height=utils.N(constants.DEFAULT_SIZE),
-                    fill="none",
-                    stroke=color,
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.BAR:
+        y = timelines[self.timeline]
+
+        if self.marker in EVENT_LABEL_OFFSETS:
+            size = constants.DEFAULT_SIZE
+            elem = marker_element(
+                self.marker,
+                color,
+                center=utils.N(x),
+                middle=utils.N(y + size / 2),
+                top=utils.N(y),
+                left=utils.N(x - size / 2),
+                bar=utils.N(x - size / 8),
+            )
+            self.label_x_offset = EVENT_LABEL_OFFSETS[self.marker]
+        else:  # Pyramid, triangle or star; drawn as a path.
+            if self.marker == constants.STAR:
+                paint = dict(fill="none", stroke=color)
+            else:
+                paint = dict(fill=color, stroke="none")
+            if defs is None:
+                path = marker_path(self.marker, x, y)
+                elem = Element("path", d=path, **paint)
+            else:
                 elem = Element(
-                    "rect",
-                    x=utils.N(x - constants.DEFAULT_SIZE / 8),
-                    y=utils.N(timelines[self.timeline]),
-                    width=utils.N(constants.DEFAULT_SIZE / 4),
-                    height=utils.N(constants.DEFAULT_SIZE),
-                    fill=color,
-                    stroke="none",
-                )
-                self.label_x_offset = constants.DEFAULT_SIZE / 8
-
-            case constants.PYRAMID:
-                path = (
-                    Path(x, timelines[self.timeline])
-                    .L(
-                        x - constants.DEFAULT_SIZE / 2,
-                        timelines[self.timeline] + constants.DEFAULT_SIZE,
-                    )
-                    .h(constants.DEFAULT_SIZE)
-                    .Z()
+                    "use",
+                    href=f"#{marker_def(defs, self.marker)}",
+                    x=utils.N(x),
+                    y=utils.N(y),
+                    **paint,
                 )
-                elem = Element("path", d=path, fill=color, stroke="none")
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.TRIANGLE:
-                path = (
-                    Path(x, timelines[self.timeline] + constants.DEFAULT_SIZE)
-                    .L(
-                        x - constants.DEFAULT_SIZE / 2,
-                        timelines[self.timeline],
-                    )
-                    .h(constants.DEFAULT_SIZE)
-                    .Z()
-                )
-                elem = Element("path", d=path, fill=color, stroke="none")
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.STAR:
-                center = Vector2(
-                    x, timelines[self.timeline] + constants.DEFAULT_SIZE / 2
-                )
-                length = constants.DEFAULT_SIZE * math.sqrt(2) / 4
-                path = (
-                    Path(
-                        x - constants.DEFAULT_SIZE / 2,
-                        timelines[self.timeline] + constants.DEFAULT_SIZE / 2,
-                    )
-                    .h(constants.DEFAULT_SIZE)
-                    .M(x, timelines[self.timeline])
-                    .v(constants.DEFAULT_SIZE)
-                    .M(center.x - length, center.y - length)
-                    .L(center.x + length, center.y + length)
-                    .M(center.x + length, center.y - length)
-                    .L(center.x - length, center.y + length)
-                )
-                elem = Element("path", d=path, fill="none", stroke=color)
-                self.label_x_offset = constants.DEFAULT_SIZE / 2
-
-            case constants.NONE:
-                elem = Element("g", fill=color, stroke="none")
-                self.label_x_offset = 0
-
-        elem["stroke-width"] = 2
+            elem["stroke-width"] = 2
+            self.label_x_offset = constants.DEFAULT_SIZE / 2
 
         # Get error bars if fuzzy value; place below marker itself.
         if self.fuzzy and isinstance(self.instant, dict):
@@ -648,18 +843,12 @@ class Event(_Entry):
                     anchor = "start"
                 anchor = "start"
 
-        label = Element(
-            "text",
+        return label_element(
             self.label,
-            x=utils.N(x),
-            y=utils.N(
-                timelines[self.timeline]
-                + (constants.DEFAULT_SIZE + self.DEFAULT_FONT_SIZE) / 2
-                - self.DEFAULT_FONT_SIZE * constants.FONT_DESCEND
-            ),
+            utils.N(x),
+            utils.N(get_baseline(timelines[self.timeline])),
+            anchor,
         )
-        label["text-anchor"] = anchor
-        return label
 
 
 class Period(_Entry):
@@ -704,21 +893,27 @@ class Period(_Entry):
             high = self.end
         return (low, high)
 
-    def render_graphic(self, timelines, dimension):
+    def render_graphic(self, timelines, dimension, defs=None):
+        """Return the graphic for the period. If a dictionary of definitions
+        is given, then gradients are referred to there, else they are
+        defined within the graphic.
+        """
+        local = defs is None
+        if local:
+            defs = {}
+
         # Simple case: do not show fuzzy values, or no fuzzy values.
         if (
             self.fuzzy == constants.NONE
             and not isinstance(self.begin, dict)
             and not isinstance(self.end, dict)
         ):
-            result = Element(
-                "rect",
-                x=utils.N(dimension.get_pixel(self.begin)),
-                y=utils.N(timelines[self.timeline]),
-                width=utils.N(dimension.get_width(self.begin, self.end)),
-                height=constants.DEFAULT_SIZE,
+            result = period_element(
+                utils.N(dimension.get_pixel(self.begin)),
+                utils.N(timelines[self.timeline]),
+                utils.N(dimension.get_width(self.begin, self.end)),
+                self.color,
             )
-            result["fill"] = self.color or "white"
 
         # Fuzzy value(s) to be shown.
         else:
@@ -766,13 +961,11 @@ class Period(_Entry):
             match self.fuzzy:
 
                 case constants.ERROR:
-                    result += Element(
-                        "rect",
-                        x=utils.N(dimension.get_pixel(begin)),
-                        y=utils.N(y),
-                        width=utils.N(dimension.get_width(begin, end)),
-                        height=constants.DEFAULT_SIZE,
-                        fill=self.color or "white",
+                    result += period_element(
+                        utils.N(dimension.get_pixel(begin)),
+                        utils.N(y),
+                        utils.N(dimension.get_width(begin, end)),
+                        self.color,
                     )
                     if isinstance(self.begin, dict):
                         result += self.render_graphic_error(
@@ -817,16 +1010,10 @@ class Period(_Entry):
                         )
                     # The left gradient of the period.
                     if x1 < x2:
-                        result += (defs := Element("defs"))
                         # The gradient-filled rectangle.
-                        id1 = next(utils.unique_id)
-                        defs += (fill1 := Element("linearGradient", id=id1))
-                        fill1 += (stop := Element("stop", offset=0))
-                        stop["stop-color"] = self.color or "white"
-                        stop["stop-opacity"] = 0
-                        fill1 += (stop := Element("stop", offset=1))
-                        stop["stop-color"] = self.color or "white"
-                        stop["stop-opacity"] = 1
+                        id1 = gradient_def(
+                            defs, self.color or "white", (0, 1), stable=not local
+                        )
                         result += Element(
                             "rect",
                             x=x1,
@@ -837,14 +1024,7 @@ class Period(_Entry):
                             fill=f"url(#{id1})",
                         )
                         # Lines at the long edges of the gradient-filled rectangle.
-                        id2 = next(utils.unique_id)
-                        defs += (stroke1 := Element("linearGradient", id=id2))
-                        stroke1 += (stop := Element("stop", offset=0))
-                        stop["stop-color"] = "black"
-                        stop["stop-opacity"] = 0
-                        stroke1 += (stop := Element("stop", offset=1))
-                        stop["stop-color"] = "black"
-                        stop["stop-opacity"] = 1
+                        id2 = gradient_def(defs, "black", (0, 1), stable=not local)
                         result += Element(
                             "path",
                             d=Path(x1, y).H(x2).m(0, constants.DEFAULT_SIZE).H(x1),
@@ -864,16 +1044,10 @@ class Period(_Entry):
 
                     # The right gradient of the period.
                     if x3 < x4:
-                        result += (defs := Element("defs"))
-                        id3 = next(utils.unique_id)
-                        defs += (fill2 := Element("linearGradient", id=id3))
-                        fill2 += (stop := Element("stop", offset=0))
-                        stop["stop-color"] = self.color or "white"
-                        stop["stop-opacity"] = 1
-                        fill2 += (stop := Element("stop", offset=1))
-                        stop["stop-color"] = self.color or "white"
-                        stop["stop-opacity"] = 0
                         # The gradient-filled rectangle.
+                        id3 = gradient_def(
+                            defs, self.color or "white", (1, 0), stable=not local
+                        )
                         result += Element(
                             "rect",
                             x=utils.N(x3),
@@ -884,14 +1058,7 @@ class Period(_Entry):
                             fill=f"url(#{id3})",
                         )
                         # Lines at the long edges of the gradient-filled rectangle.
-                        id4 = next(utils.unique_id)
-                        defs += (stroke2 := Element("linearGradient", id=id4))
-                        stroke2 += (stop := Element("stop", offset=0))
-                        stop["stop-color"] = "black"
-                        stop["stop-opacity"] = 1
-                        stroke2 += (stop := Element("stop", offset=1))
-                        stop["stop-color"] = "black"
-                        stop["stop-opacity"] = 0
+                        id4 = gradient_def(defs, "black", (1, 0), stable=not local)
                         result += Element(
                             "path",
                             d=Path(x3, y).H(x4).m(0, constants.DEFAULT_SIZE).H(x3),
@@ -911,6 +1078,9 @@ class Period(_Entry):
 
                 case constants.TAPER:
                     raise NotImplementedError
+
+        if local and defs:
+            result.insert(0, Element("defs", *defs.values()))
         return result
 
     def render_label(self, timelines, dimension):
@@ -952,19 +1122,299 @@ class Period(_Entry):
                 x = dimension.get_pixel(high) + constants.DEFAULT_PADDING
                 anchor = "start"
 
-        label = Element(
-            "text",
+        return label_element(
             self.label,
-            x=utils.N(x),
-            y=utils.N(
-                timelines[self.timeline]
-                + (constants.DEFAULT_SIZE + self.DEFAULT_FONT_SIZE) / 2
-                - self.DEFAULT_FONT_SIZE * constants.FONT_DESCEND
-            ),
-            fill=color,
+            utils.N(x),
+            utils.N(get_baseline(timelines[self.timeline])),
+            anchor,
+            fill=str(color),
+        )
+
+
+# Distance from the instant to the edge of the marker, for label placement.
+# Only markers rendered as simple elements; not those rendered as paths.
+EVENT_LABEL_OFFSETS = {
+    constants.DISC: constants.DEFAULT_SIZE / 2,
+    constants.CIRCLE: constants.DEFAULT_SIZE / 2,
+    constants.OVAL: constants.DEFAULT_SIZE / 5,
+    constants.ELLIPSE: constants.DEFAULT_SIZE / 5,
+    constants.BLOCK: constants.DEFAULT_SIZE / 2,
+    constants.SQUARE: constants.DEFAULT_SIZE / 2,
+    constants.BAR: constants.DEFAULT_SIZE / 8,
+    constants.NONE: 0,
+}
+
+
+def marker_element(marker, color, center, middle, top, left, bar):
+    """Return the element for the marker drawn as a simple shape, given the
+    formatted coordinates: the instant, the middle and top of the timeline,
+    and the left edges of the square and of the bar shapes.
+    """
+    size = constants.DEFAULT_SIZE
+    match marker:
+        case constants.DISC | constants.CIRCLE:
+            attrs = {"cx": center, "cy": middle, "r": str(size / 2)}
+            tag = "circle"
+        case constants.OVAL | constants.ELLIPSE:
+            attrs = {
+                "cx": center,
+                "cy": middle,
+                "rx": str(size / 5),
+                "ry": str(size / 2),
+            }
+            tag = "ellipse"
+        case constants.BLOCK | constants.SQUARE:
+            attrs = {
+                "x": left,
+                "y": top,
+                "width": utils.N(size),
+                "height": utils.N(size),
+            }
+            tag = "rect"
+        case constants.BAR:
+            attrs = {
+                "x": bar,
+                "y": top,
+                "width": utils.N(size / 4),
+                "height": utils.N(size),
+            }
+            tag = "rect"
+        case constants.NONE:
+            attrs = {}
+            tag = "g"
+    if marker in (constants.CIRCLE, constants.ELLIPSE, constants.SQUARE):
+        attrs["fill"] = "none"
+        attrs["stroke"] = color
+    else:
+        attrs["fill"] = color
+        attrs["stroke"] = "none"
+    attrs["stroke-width"] = "2"
+    return Element.from_attrs(tag, attrs)
+
+
+def period_element(x, y, width, color):
+    "Return the rectangle for the period, given the formatted coordinates."
+    attrs = {"x": x, "y": y, "width": width, "height": str(constants.DEFAULT_SIZE)}
+    attrs["fill"] = color or "white"
+    return Element.from_attrs("rect", attrs)
+
+
+def label_element(label, x, y, anchor, fill=None):
+    "Return the text element for the label, given the formatted coordinates."
+    attrs = {"x": x, "y": y}
+    if fill is not None:
+        attrs["fill"] = fill
+    attrs["text-anchor"] = anchor
+    return Element.from_attrs("text", attrs, label)
+
+
+def get_baseline(y):
+    "Return the baseline of a label in the timeline at y."
+    font_size = _Entry.DEFAULT_FONT_SIZE
+    return (
+        y
+        + (constants.DEFAULT_SIZE + font_size) / 2
+        - font_size * constants.FONT_DESCEND
+    )
+
+
+def format_numbers(values):
+    """Return the list of compact string representations of the values
+    in the NumPy array. The same as 'utils.N' for each value.
+    """
+    integral = numpy.mod(values, 1.0) < constants.PRECISION
+    integral |= (values < 0.0) & (numpy.mod(-values, 1.0) < constants.PRECISION)
+    return [
+        str(i) if is_integral else f"{v:.3f}"
+        for v, i, is_integral in zip(
+            values.tolist(),
+            numpy.rint(values).astype(numpy.int64).tolist(),
+            integral.tolist(),
         )
-        label["text-anchor"] = anchor
-        return label
+    ]
+
+
+def marker_path(marker, x, y):
+    "Return the path for the marker at the instant x, in the timeline at y."
+    size = constants.DEFAULT_SIZE
+    match marker:
+        case constants.PYRAMID:
+            return Path(x, y).L(x - size / 2, y + size).h(size).Z()
+        case constants.TRIANGLE:
+            return Path(x, y + size).L(x - size / 2, y).h(size).Z()
+        case constants.STAR:
+            center = Vector2(x, y + size / 2)
+            length = size * math.sqrt(2) / 4
+            return (
+                Path(x - size / 2, y + size / 2)
+                .h(size)
+                .M(x, y)
+                .v(size)
+                .M(center.x - length, center.y - length)
+                .L(center.x + length, center.y + length)
+                .M(center.x + length, center.y - length)
+                .L(center.x - length, center.y + length)
+            )
+
+
+def marker_def(defs, marker):
+    """Return the id of the definition of the marker, drawn at the origin.
+    Add it to the dictionary of definitions, if not already there.
+    """
+    id = utils.get_stable_id("marker", marker)
+    if id not in defs:
+        defs[id] = Element("path", id=id, d=marker_path(marker, 0, 0))
+    return id
+
+
+def gradient_def(defs, color, opacities, stable=True):
+    """Return the id of the definition of the horizontal linear gradient
+    of the color between the opacities. Add it to the dictionary of
+    definitions, if not already there.
+    If not stable, then the id is unique; for definitions within an entry,
+    which would otherwise be repeated in the document.
+    """
+    if stable:
+        id = utils.get_stable_id("gradient", color, opacities)
+    else:
+        id = next(utils.unique_id)
+    if id not in defs:
+        defs[id] = (gradient := Element("linearGradient", id=id))
+        for offset, opacity in enumerate(opacities):
+            gradient += (stop := Element("stop", offset=offset))
+            stop["stop-color"] = color
+            stop["stop-opacity"] = opacity
+    return id
+
+
+def render_entries_numpy(entries, timelines, dimension, defs=None):
+    """Return the lists of graphics and of labels (or None) for the entries.
+    The coordinates of events having simple markers and of periods without
+    fuzzy values are computed and formatted in bulk using NumPy, and their
+    elements are created directly from the attribute strings.
+    Other entries are rendered by their own methods.
+    """
+    graphics = [None] * len(entries)
+    labels = [None] * len(entries)
+    events = []  # Indexes of the events to render in bulk.
+    periods = []  # Indexes of the periods to render in bulk.
+    others = []  # Indexes of the entries to render by their own methods.
+    for i, entry in enumerate(entries):
+        if isinstance(entry, Event):
+            if (
+                not isinstance(entry.instant, dict)
+                and entry.marker in EVENT_LABEL_OFFSETS
+            ):
+                events.append(i)
+                continue
+        elif (
+            not isinstance(entry.begin, dict)
+            and not isinstance(entry.end, dict)
+            and entry.fuzzy in (constants.NONE, constants.ERROR)
+        ):
+            periods.append(i)
+            continue
+        others.append(i)
+    # Labels may depend on the graphics; so all graphics first.
+    for i in others:
+        graphics[i] = entries[i].render_graphic(timelines, dimension, defs)
+    for i in others:
+        labels[i] = entries[i].render_label(timelines, dimension)
+
+    size = constants.DEFAULT_SIZE
+    # Vertical positions are the same for all entries in a timeline.
+    tops = {}
+    middles = {}
+    baselines = {}
+    for timeline, y in timelines.items():
+        tops[timeline] = utils.N(y)
+        middles[timeline] = utils.N(y + size / 2)
+        baselines[timeline] = utils.N(get_baseline(y))
+
+    if events:
+        x = dimension.get_pixel(
+            numpy.array([entries[i].instant for i in events], dtype=float)
+        )
+        offsets = numpy.array(
+            [EVENT_LABEL_OFFSETS[entries[i].marker] for i in events], dtype=float
+        )
+        centers = format_numbers(x)
+        lefts = format_numbers(x - size / 2)
+        bars = format_numbers(x - size / 8)
+        label_lefts = format_numbers(x - (offsets + constants.DEFAULT_PADDING))
+        label_rights = format_numbers(x + (offsets + constants.DEFAULT_PADDING))
+        for j, i in enumerate(events):
+            entry = entries[i]
+            graphics[i] = marker_element(
+                entry.marker,
+                entry.color or "black",
+                center=centers[j],
+                middle=middles[entry.timeline],
+                top=tops[entry.timeline],
+                left=lefts[j],
+                bar=bars[j],
+            )
+            if not entry.label:
+                continue
+            match entry.placement:
+                case constants.LEFT:
+                    label_x = label_lefts[j]
+                    anchor = "end"
+                case constants.CENTER:
+                    label_x = centers[j]
+                    anchor = "middle"
+                case constants.RIGHT:
+                    label_x = label_rights[j]
+                    anchor = "start"
+            labels[i] = label_element(
+                entry.label, label_x, baselines[entry.timeline], anchor
+            )
+
+    if periods:
+        begins = numpy.array([entries[i].begin for i in periods], dtype=float)
+        ends = numpy.array([entries[i].end for i in periods], dtype=float)
+        x = dimension.get_pixel(begins)
+        lefts = format_numbers(x)
+        widths = format_numbers(dimension.get_width(begins, ends))
+        label_lefts = format_numbers(x - constants.DEFAULT_PADDING)
+        label_centers = format_numbers(dimension.get_pixel((begins + ends) / 2))
+        label_rights = format_numbers(
+            dimension.get_pixel(ends) + constants.DEFAULT_PADDING
+        )
+        contrasts = {}  # Key: color; value: best contrasting color.
+        for j, i in enumerate(periods):
+            entry = entries[i]
+            graphic = period_element(
+                lefts[j], tops[entry.timeline], widths[j], entry.color
+            )
+            if entry.fuzzy == constants.ERROR:
+                graphic = Element("g", graphic)
+            graphics[i] = graphic
+
+            if not entry.label:
+                continue
+            color = "black"
+            match entry.placement:
+                case constants.LEFT:
+                    label_x = label_lefts[j]
+                    anchor = "end"
+                case constants.CENTER:
+                    label_x = label_centers[j]
+                    anchor = "middle"
+                    if entry.color:
+                        try:
+                            color = contrasts[entry.color]
+                        except KeyError:
+                            color = str(Color(entry.color).best_contrast)
+                            contrasts[entry.color] = color
+                case constants.RIGHT:
+                    label_x = label_rights[j]
+                    anchor = "start"
+            labels[i] = label_element(
+                entry.label, label_x, baselines[entry.timeline], anchor, fill=color
+            )
+
+    return graphics, labels
 
 
 register(Timelines)
@@ -1,11 +1,16 @@
 "Various utility functions."
 
 import constants
+import functools
+import hashlib
 import itertools
 
 
+@functools.lru_cache(maxsize=4096, typed=True)
 def N(x):
-    "Return a compact string representation of the numerical value."
+    """Return a compact string representation of the numerical value.
+    Cached, since the same values (sizes, padding, positions) recur often.
+    """
     assert isinstance(x, (int, float))
     if (x < 0.0 and -x % 1.0 < constants.PRECISION) or x % 1.0 < constants.PRECISION:
         return f"{round(x):d}"
@@ -13,22 +18,35 @@ def N(x):
         return f"{x:.3f}"
 
 
+# Character widths at 100 pt for each font and style, as flat lookup tables.
+# Key: (font, style); value: (dict of character widths, default width).
+_WIDTHS = {}
+for font, widths in constants.CHARACTER_WIDTHS.items():
+    for style in ("n", "i", "b", "ib"):
+        _WIDTHS[(font, style)] = (
+            dict([(c, w[style]) for c, w in widths.items() if c != "default"]),
+            widths["default"][style],
+        )
+
+
+@functools.lru_cache(maxsize=8192)
 def get_text_length(text, font, size, italic=False, bold=False):
     """Compute length of string given the size in points (pt).
     Uses empirically based measurements.
+    Cached, since the same texts (e.g. timeline names) are measured repeatedly.
     """
     assert font in ("sans-serif", "serif", "monospace"), font
-    widths = constants.CHARACTER_WIDTHS[font]
     if italic:
         if bold:
-            key = "ib"
+            style = "ib"
         else:
-            key = "i"
+            style = "i"
     elif bold:
-        key = "b"
+        style = "b"
     else:
-        key = "n"
-    total = sum([widths.get(c, widths["default"])[key] for c in text])
+        style = "n"
+    widths, default = _WIDTHS[(font, style)]
+    total = sum(map(widths.get, text, itertools.repeat(default)))
     return total * size / 100
 
 
@@ -41,6 +59,13 @@ def get_unique(id="id"):
 unique_id = get_unique()
 
 
+def get_stable_id(*key):
+    """Return an id derived from the key. The same key gives the same id
+    in all runs, regardless of the order in which diagrams are built.
+    """
+    return "def" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:8]
+
+
 if __name__ == "__main__":
     print(next(unique_id))
     print(next(unique_id))
@@ -0,0 +1,147 @@
+"""Watch a YAML file, and the files it includes, for changes.
+On a change, only the changed files and the files including them are read
+again; the other included diagrams are reused. The build cache is used,
+so that diagrams which have not changed are not built again.
+Remote locations are not watched.
+"""
+
+import os
+import tempfile
+import time
+import urllib.parse
+
+import cache
+from diagram import Reader, retrieve
+
+
+def get_mtime(location):
+    "Return the modification time of the file, or None if it does not exist."
+    try:
+        return os.stat(location).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Reuse(dict):
+    """Diagrams to reuse when loading, keyed by location.
+    Records all locations looked up; that is, all locations included.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = set()
+
+    def __contains__(self, location):
+        self.lookups.add(location)
+        return super().__contains__(location)
+
+
+class Watcher:
+    "Keep a diagram read from a file up to date with changes in its files."
+
+    def __init__(self, location):
+        self.location = Reader(location).location
+        self.diagram = None
+        self.diagrams = {}  # Key: location; value: included diagram.
+        self.includes = {}  # Key: location; value: locations directly included.
+        self.mtimes = {}  # Key: location of watched file; value: mtime.
+
+    def load(self, changed=None):
+        """Read the diagram. Included diagrams not affected by the changed
+        locations are reused. If no changed locations, then read everything.
+        Raise ValueError if any problem.
+        """
+        reuse = Reuse()
+        if changed:
+            affected = self.get_affected(changed)
+            for location, diagram in self.diagrams.items():
+                if location not in affected:
+                    reuse[location] = diagram
+        try:
+            diagram = retrieve(self.location, reuse=reuse)
+        except Exception:
+            # Also watch any new files included before the error, whatever it
+            # is, so that a fix of any of them is noticed.
+            self.set_mtimes(set(self.mtimes).union([self.location], reuse.lookups))
+            raise
+        self.diagram = diagram
+        self.diagrams = {}
+        self.includes = {}
+        self.scan(diagram, self.location)
+        self.set_mtimes(set(self.diagrams).union([self.location]))
+
+    def scan(self, diagram, location):
+        "Record the diagrams included in the diagram read from the location."
+        includes = self.includes.setdefault(location, set())
+        for subdiagram in diagram.get_subdiagrams():
+            try:
+                sublocation = Reader(subdiagram.location).location
+            except AttributeError:  # Not included; part of this location.
+                self.scan(subdiagram, location)
+            else:
+                includes.add(sublocation)
+                self.diagrams.setdefault(sublocation, subdiagram)
+                self.scan(subdiagram, sublocation)
+
+    def get_affected(self, changed):
+        "Return the changed locations and all locations including them."
+        affected = set(changed)
+        while True:
+            more = set(
+                [
+                    location
+                    for location, includes in self.includes.items()
+                    if location not in affected and includes.intersection(affected)
+                ]
+            )
+            if not more:
+                return affected
+            affected.update(more)
+
+    def set_mtimes(self, locations):
+        "Record the current modification times of the locations that are files."
+        self.mtimes = {}
+        for location in locations:
+            if not urllib.parse.urlparse(location).scheme:
+                self.mtimes[location] = get_mtime(location)
+
+    def poll(self):
+        "Return the set of watched files that have changed since last loaded."
+        return set(
+            [
+                location
+                for location, mtime in self.mtimes.items()
+                if get_mtime(location) != mtime
+            ]
+        )
+
+    def run(self, write, interval=0.5, report=print):
+        """Load the diagram and call 'write' with it. Then poll the files every
+        'interval' seconds, and load and write again whenever any has changed.
+        The time taken is reported. Runs until interrupted.
+        """
+        buildcache = cache.get()
+        with tempfile.TemporaryDirectory() as dirpath:
+            if buildcache is None:
+                cache.enable(dirpath)
+            try:
+                changed = None
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        self.load(changed)
+                        write(self.diagram)
+                    except ValueError as error:
+                        report(f"Error: {error}")
+                    except Exception as error:  # Keep watching regardless.
+                        report(f"Error: {error!r}")
+                    else:
+                        seconds = time.perf_counter() - start
+                        if changed:
+                            report(f"Changed {', '.join(sorted(changed))}")
+                        report(f"Rendered in {seconds:.3f} s")
+                    while not (changed := self.poll()):
+                        time.sleep(interval)
+            finally:
+                if buildcache is None:
+                    cache.disable()